@@ -0,0 +1,81 @@
+#!/usr/share/ucs-test/runner python
+## -*- coding: utf-8 -*-
+## desc: test that CSV files written while the objects are created equal those written from a list of objects
+## tags: [apptest]
+## exposure: dangerous
+## packages:
+##   - univention-apple-school-manager-connector
+
+from tempfile import NamedTemporaryFile
+from univention.config_registry import handler_unset
+import univention.testing.strings as uts
+import univention.testing.ucr as ucr_test
+from univention.asm.csv.csv_file import AsmStaffCsvFile, csv_file_generators
+from univention.testing.ucsschool.importusers_cli_v2 import ImportTestbase
+
+
+class ShortHeaderStaffCsvFile(AsmStaffCsvFile):
+	"""Header from the pre-pass is one column too short."""
+
+	def get_header(self):
+		return super(ShortHeaderStaffCsvFile, self).get_header()[:-1]
+
+
+class Test(ImportTestbase):
+	def create_csv(self, csv_file_class, schools, pre_pass):
+		with NamedTemporaryFile() as csv_file:
+			asm_csv_file = csv_file_class(csv_file.name, schools)
+			if pre_pass:
+				asm_csv_file.write_csv()
+			else:
+				asm_csv_file.write_csv(objs=list(asm_csv_file.find_and_create_objects()))
+			csv_file.flush()
+			csv_file.seek(0)
+			return csv_file.read()
+
+	def test(self):
+		school1 = self.ou_A.name
+		school2 = self.ou_B.name
+		school3 = self.ou_C.name
+		schools = [school1, school2, school3]
+		school_class1 = '{}-{}'.format(school1, uts.random_username())
+		school_class2 = '{}-{}'.format(school2, uts.random_username())
+
+		self.log.info('*** Creating users...')
+		# more locations and instructors than the default headers have columns
+		self.schoolenv.create_teacher(school1, classes=school_class1)
+		self.schoolenv.create_teacher(school1, schools=schools, classes='{},{}'.format(school_class1, school_class2))
+		self.schoolenv.create_teacher_and_staff(school2, schools=schools, classes=school_class1)
+		self.schoolenv.create_staff(school3)
+		self.schoolenv.create_student(school1, classes=school_class1)
+		self.schoolenv.create_student(school2, schools=schools, classes='{},{}'.format(school_class1, school_class2))
+
+		for filename, csv_file_class in sorted(csv_file_generators.items()):
+			expected = self.create_csv(csv_file_class, schools, pre_pass=False)
+			got = self.create_csv(csv_file_class, schools, pre_pass=True)
+			if got == expected:
+				self.log.info('OK: %s content is equal with and without header pre-pass.', filename)
+			else:
+				self.fail('{} differs when written with the header pre-pass.\nexp: {!r}\ngot: {!r}'.format(
+					filename, expected, got))
+
+		self.log.info('*** Checking that objects with a longer header than the pre-pass found are not written...')
+		try:
+			self.create_csv(ShortHeaderStaffCsvFile, schools, pre_pass=True)
+		except RuntimeError as exc:
+			self.log.info('OK: %s', exc)
+		else:
+			self.fail('Staff CSV file was written with a too short header.')
+
+
+if __name__ == '__main__':
+	with ucr_test.UCSTestConfigRegistry():
+		handler_unset([
+			"asm/attributes/user/email/prepend_domain",
+			"asm/attributes/staff/anonymize",
+			"asm/attributes/student/anonymize",
+			"asm/ldap_filter/staff",
+			"asm/ldap_filter/students",
+			"asm/csv/processes",
+		])
+		Test().run()
@@ -0,0 +1,68 @@
+#!/usr/share/ucs-test/runner python
+## -*- coding: utf-8 -*-
+## desc: test that staff and student CSV files created in worker processes equal those created in one process
+## tags: [apptest]
+## exposure: dangerous
+## packages:
+##   - univention-apple-school-manager-connector
+
+from tempfile import NamedTemporaryFile
+from univention.config_registry import handler_set, handler_unset
+import univention.testing.strings as uts
+import univention.testing.ucr as ucr_test
+from univention.asm.csv.csv_file import AsmStaffCsvFile, AsmStudentsCsvFile
+from univention.asm.utils import update_ucr
+from univention.testing.ucsschool.importusers_cli_v2 import ImportTestbase
+
+
+class Test(ImportTestbase):
+	def create_csv(self, csv_file_class, schools):
+		with NamedTemporaryFile() as csv_file:
+			csv_file_class(csv_file.name, schools).write_csv()
+			csv_file.flush()
+			csv_file.seek(0)
+			return csv_file.read()
+
+	def test(self):
+		school1 = self.ou_A.name
+		school2 = self.ou_B.name
+		schools = [school1, school2]
+
+		self.log.info('*** Creating users...')
+		# with asm/csv/shard_size=2, school1 is split into several shards
+		for i in range(5):
+			self.schoolenv.create_teacher(school1)
+			self.schoolenv.create_student(school1)
+		self.schoolenv.create_teacher(
+			school2, schools=schools, mailaddress='{}@{}'.format(uts.random_name(), self.maildomain))
+		self.schoolenv.create_teacher_and_staff(school1, schools=schools)
+		self.schoolenv.create_student(
+			school2, schools=schools, mailaddress='{}@{}'.format(uts.random_name(), self.maildomain))
+		self.schoolenv.create_student(school1, schools=schools)
+
+		for csv_file_class in (AsmStaffCsvFile, AsmStudentsCsvFile):
+			handler_set(['asm/csv/processes=1'])
+			update_ucr()
+			expected = self.create_csv(csv_file_class, schools)
+			handler_set(['asm/csv/processes=3', 'asm/csv/shard_size=2'])
+			update_ucr()
+			got = self.create_csv(csv_file_class, schools)
+			if got == expected:
+				self.log.info('OK: %s content is equal with and without worker processes.', csv_file_class.__name__)
+			else:
+				self.fail('{} differs when created in worker processes.\nexp: {!r}\ngot: {!r}'.format(
+					csv_file_class.__name__, expected, got))
+
+
+if __name__ == '__main__':
+	with ucr_test.UCSTestConfigRegistry():
+		handler_unset([
+			"asm/attributes/user/email/prepend_domain",
+			"asm/attributes/staff/anonymize",
+			"asm/attributes/student/anonymize",
+			"asm/ldap_filter/staff",
+			"asm/ldap_filter/students",
+			"asm/csv/workers",
+			"asm/zip/compression_threads",
+		])
+		Test().run()
@@ -0,0 +1,79 @@
+#!/usr/share/ucs-test/runner python
+## -*- coding: utf-8 -*-
+## desc: test that CSV files created in parallel threads equal those created one after the other
+## tags: [apptest]
+## exposure: dangerous
+## packages:
+##   - univention-apple-school-manager-connector
+
+import os
+import shutil
+import tempfile
+from univention.config_registry import handler_set, handler_unset
+import univention.testing.strings as uts
+import univention.testing.ucr as ucr_test
+from univention.asm.csv.csv_file import create_csv_files
+from univention.asm.utils import update_ucr
+from univention.testing.ucsschool.importusers_cli_v2 import ImportTestbase
+
+
+class Test(ImportTestbase):
+	def create_csv_files(self, schools):
+		tmp_dir = tempfile.mkdtemp()
+		try:
+			res = {}
+			for path in create_csv_files(os.path.join(tmp_dir, 'csv'), schools):
+				with open(path, 'rb') as fp:
+					res[os.path.basename(path)] = fp.read()
+			return res
+		finally:
+			shutil.rmtree(tmp_dir)
+
+	def test(self):
+		school1 = self.ou_A.name
+		school2 = self.ou_B.name
+		schools = [school1, school2]
+		school_class1 = '{}-{}'.format(school1, uts.random_username())
+		school_class2 = '{}-{}'.format(school2, uts.random_username())
+
+		self.log.info('*** Creating users...')
+		self.schoolenv.create_teacher(school1, classes=school_class1)
+		self.schoolenv.create_teacher(
+			school2, schools=schools, classes='{},{}'.format(school_class1, school_class2),
+			mailaddress='{}@{}'.format(uts.random_name(), self.maildomain))
+		self.schoolenv.create_teacher_and_staff(school1, schools=schools, classes=school_class2)
+		self.schoolenv.create_staff(school2)
+		self.schoolenv.create_student(school1, classes=school_class1)
+		self.schoolenv.create_student(
+			school2, schools=schools, classes='{},{}'.format(school_class1, school_class2),
+			mailaddress='{}@{}'.format(uts.random_name(), self.maildomain))
+		self.schoolenv.create_student(school1, schools=schools, classes=school_class2)
+
+		# UDM objects are not loaded in parallel threads, so asm/csv/workers needs asm/ldap/raw_users
+		handler_set(['asm/ldap/raw_users=yes', 'asm/csv/workers=1'])
+		update_ucr()
+		expected = self.create_csv_files(schools)
+		handler_set(['asm/csv/workers=4'])
+		update_ucr()
+		got = self.create_csv_files(schools)
+		if sorted(got) != sorted(expected):
+			self.fail('Expected CSV files {!r}, got {!r}.'.format(sorted(expected), sorted(got)))
+		for filename in sorted(expected):
+			if got[filename] == expected[filename]:
+				self.log.info('OK: %s content is equal with and without parallel threads.', filename)
+			else:
+				self.fail('{} differs when created in parallel threads.\nexp: {!r}\ngot: {!r}'.format(
+					filename, expected[filename], got[filename]))
+
+
+if __name__ == '__main__':
+	with ucr_test.UCSTestConfigRegistry():
+		handler_unset([
+			"asm/attributes/user/email/prepend_domain",
+			"asm/attributes/staff/anonymize",
+			"asm/attributes/student/anonymize",
+			"asm/ldap_filter/staff",
+			"asm/ldap_filter/students",
+			"asm/csv/processes",
+		])
+		Test().run()
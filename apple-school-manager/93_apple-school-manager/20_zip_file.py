@@ -8,6 +8,8 @@
 ## bugs: [47622]
 
 import os
+import time
+import filecmp
 import csv
 from operator import itemgetter
 import tempfile
@@ -423,6 +425,16 @@ class Test(ImportTestbase):
 				'classes.csv', 'courses.csv', 'locations.csv', 'rosters.csv', 'staff.csv', 'students.csv'}
 			assert extracted_csv_files == expected_csv_files
 
+			self.log.info('*** Checking that the same data results in the same ZIP file...')
+			with tempfile.NamedTemporaryFile() as zip_result_file2:
+				zip_file1 = AsmZipFile(zip_result_file.name, schools)
+				zip_file1.write_zip()
+				time.sleep(2)  # ZIP timestamps have a resolution of two seconds
+				zip_file2 = AsmZipFile(zip_result_file2.name, schools)
+				zip_file2.write_zip()
+				assert zip_file1.content_hash and zip_file1.content_hash == zip_file2.content_hash
+				assert filecmp.cmp(zip_result_file.name, zip_result_file2.name, shallow=False)
+
 		check_classes(os.path.join(tmp_dir, 'classes.csv'))
 		check_courses(os.path.join(tmp_dir, 'courses.csv'))
 		check_location(os.path.join(tmp_dir, 'locations.csv'))
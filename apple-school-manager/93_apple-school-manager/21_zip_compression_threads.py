@@ -0,0 +1,80 @@
+#!/usr/share/ucs-test/runner python
+## -*- coding: utf-8 -*-
+## desc: test that ZIP files compressed in parallel threads contain the same CSV files as those compressed in one thread
+## tags: [apptest]
+## exposure: dangerous
+## packages:
+##   - univention-apple-school-manager-connector
+
+import zipfile
+from tempfile import NamedTemporaryFile
+from univention.config_registry import handler_set, handler_unset
+import univention.testing.strings as uts
+import univention.testing.ucr as ucr_test
+import univention.asm.csv.zip_file as zip_file_module
+from univention.asm.csv.zip_file import AsmZipFile
+from univention.asm.utils import update_ucr
+from univention.testing.ucsschool.importusers_cli_v2 import ImportTestbase
+
+
+class Test(ImportTestbase):
+	def create_zip(self, schools):
+		with NamedTemporaryFile() as zip_result_file:
+			asm_zip_file = AsmZipFile(zip_result_file.name, schools)
+			asm_zip_file.write_zip()
+			zf = zipfile.ZipFile(zip_result_file.name)
+			bad_entry = zf.testzip()
+			if bad_entry:
+				self.fail('CRC of {} is wrong.'.format(bad_entry))
+			return asm_zip_file.content_hash, dict((name, zf.read(name)) for name in zf.namelist())
+
+	def test(self):
+		school1 = self.ou_A.name
+		school2 = self.ou_B.name
+		schools = [school1, school2]
+		school_class1 = '{}-{}'.format(school1, uts.random_username())
+
+		self.log.info('*** Creating users...')
+		for i in range(3):
+			self.schoolenv.create_teacher(school1, classes=school_class1)
+			self.schoolenv.create_student(school1, classes=school_class1)
+		self.schoolenv.create_teacher(school2, schools=schools)
+		self.schoolenv.create_student(school2, schools=schools, classes=school_class1)
+
+		# split the small CSV files into many blocks, that are compressed in parallel
+		ori_block_size = zip_file_module._ZipEntryWriter.block_size
+		zip_file_module._ZipEntryWriter.block_size = 128
+		try:
+			handler_set(['asm/zip/compression_threads=1'])
+			update_ucr()
+			expected_hash, expected = self.create_zip(schools)
+			handler_set(['asm/zip/compression_threads=4'])
+			update_ucr()
+			got_hash, got = self.create_zip(schools)
+		finally:
+			zip_file_module._ZipEntryWriter.block_size = ori_block_size
+
+		if got_hash != expected_hash:
+			self.fail('Content hash differs with parallel compression: expected {!r}, got {!r}.'.format(
+				expected_hash, got_hash))
+		if sorted(got) != sorted(expected):
+			self.fail('Expected ZIP entries {!r}, got {!r}.'.format(sorted(expected), sorted(got)))
+		for name in sorted(expected):
+			if got[name] == expected[name]:
+				self.log.info('OK: %s content is equal with and without parallel compression.', name)
+			else:
+				self.fail('{} differs when compressed in parallel threads.\nexp: {!r}\ngot: {!r}'.format(
+					name, expected[name], got[name]))
+
+
+if __name__ == '__main__':
+	with ucr_test.UCSTestConfigRegistry():
+		handler_unset([
+			"asm/attributes/user/email/prepend_domain",
+			"asm/attributes/staff/anonymize",
+			"asm/attributes/student/anonymize",
+			"asm/ldap_filter/staff",
+			"asm/ldap_filter/students",
+			"asm/csv/processes",
+		])
+		Test().run()
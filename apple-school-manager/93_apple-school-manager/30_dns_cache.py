@@ -0,0 +1,153 @@
+#!/usr/share/ucs-test/runner python
+## -*- coding: utf-8 -*-
+## desc: test persistent DNS cache of mail domain checks
+## tags: [apptest]
+## exposure: dangerous
+## packages:
+##   - univention-apple-school-manager-connector
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import univention.testing.ucr as ucr_test
+from univention.config_registry import handler_set
+
+import univention.asm.utils as asm_utils
+from univention.asm.utils import check_domains, load_dns_cache, save_dns_cache, update_ucr
+
+TTL_POSITIVE = 600
+TTL_NEGATIVE = 300
+
+logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger('main')
+
+
+class FakeQuery(object):
+	"""Replaces the DNS request, every domain exists, except those starting with `no`."""
+
+	def __init__(self):
+		self.queried = []
+
+	def __call__(self, domain):
+		self.queried.append(domain)
+		return not domain.startswith('no')
+
+
+def reset_known_domains():
+	asm_utils._known_domains.clear()
+	asm_utils._known_domains_timestamps.clear()
+
+
+def write_cache(path, content):
+	with open(path, 'wb') as fp:
+		fp.write(content)
+
+
+def read_cache(path):
+	with open(path, 'rb') as fp:
+		return json.load(fp)
+
+
+def temp_files(path):
+	return [name for name in os.listdir(os.path.dirname(path)) if name.startswith('.dns_cache.')]
+
+
+def test_ttl(path, fake_query):
+	log.info('*** TTL: expired entries are looked up again, fresh entries are used.')
+	now = time.time()
+	entries = {
+		'fresh.example': [True, now - TTL_POSITIVE + 60],
+		'expired.example': [True, now - TTL_POSITIVE - 60],
+		'nofresh.example': [False, now - TTL_NEGATIVE + 60],
+		'noexpired.example': [False, now - TTL_NEGATIVE - 60],
+	}
+	write_cache(path, json.dumps(entries))
+	reset_known_domains()
+	assert load_dns_cache(path) == 2, 'Expected only the two fresh entries to be loaded.'
+	results = check_domains(entries.keys())
+	assert sorted(fake_query.queried) == ['expired.example', 'noexpired.example'], fake_query.queried
+	assert results == {
+		'fresh.example': True,
+		'expired.example': True,
+		'nofresh.example': False,
+		'noexpired.example': False,
+	}, results
+
+	log.info('*** Atomic rewrite: the file is replaced, looked up entries get a new timestamp.')
+	inode = os.stat(path).st_ino
+	save_dns_cache(path)
+	assert os.stat(path).st_ino != inode, 'Cache file was not replaced by a new file.'
+	assert not temp_files(path), 'Temporary files left: {!r}'.format(temp_files(path))
+	saved = read_cache(path)
+	assert set(saved) == set(entries), saved
+	for domain in ('expired.example', 'noexpired.example'):
+		assert saved[domain][1] > entries[domain][1], 'Timestamp of {!r} was not updated.'.format(domain)
+	for domain in ('fresh.example', 'nofresh.example'):
+		assert saved[domain] == entries[domain], 'Entry of {!r} was changed.'.format(domain)
+
+
+def test_broken_cache(path, fake_query, content, description):
+	log.info('*** Recovery from %s cache file.', description)
+	write_cache(path, content)
+	reset_known_domains()
+	assert load_dns_cache(path) == 0, 'Expected no entries to be loaded from {} cache file.'.format(description)
+	assert check_domains(['broken.example']) == {'broken.example': True}
+	assert fake_query.queried == ['broken.example'], fake_query.queried
+	save_dns_cache(path)
+	saved = read_cache(path)
+	assert list(saved) == ['broken.example'], saved
+	assert saved['broken.example'][0] is True, saved
+
+
+def test_unreadable_cache(path, fake_query):
+	log.info('*** Recovery from unreadable cache file.')
+	os.mkdir(path)  # open() fails with EISDIR
+	reset_known_domains()
+	assert load_dns_cache(path) == 0
+	assert check_domains(['unreadable.example']) == {'unreadable.example': True}
+	assert fake_query.queried == ['unreadable.example'], fake_query.queried
+	save_dns_cache(path)  # must not raise
+	assert not temp_files(path), 'Temporary files left: {!r}'.format(temp_files(path))
+	os.rmdir(path)
+	save_dns_cache(path)
+	assert list(read_cache(path)) == ['unreadable.example']
+
+
+def main():
+	handler_set([
+		'asm/dns/cache/ttl_positive={}'.format(TTL_POSITIVE),
+		'asm/dns/cache/ttl_negative={}'.format(TTL_NEGATIVE),
+	])
+	update_ucr()
+	tmp_dir = tempfile.mkdtemp()
+	path = os.path.join(tmp_dir, 'dns_cache.json')
+	ori_query_domain = asm_utils._query_domain
+	try:
+		tests = [
+			(test_ttl, ()),
+			(test_broken_cache, (b'{"truncated.example": [true, 15', 'corrupt')),
+			(test_broken_cache, (b'["not", "a", "dict"]', 'invalid')),
+			(test_broken_cache, (b'{"bad.example": 1, "worse.example": [true, "x"]}', 'malformed entries in')),
+			(test_broken_cache, ('{{"null.example": [null, {}]}}'.format(time.time()).encode('ascii'), 'unverified entry in')),
+			(test_unreadable_cache, ()),
+		]
+		for test, args in tests:
+			fake_query = FakeQuery()
+			asm_utils._query_domain = fake_query
+			if os.path.exists(path):
+				os.remove(path)
+			test(path, fake_query, *args)
+	finally:
+		asm_utils._query_domain = ori_query_domain
+		reset_known_domains()
+		shutil.rmtree(tmp_dir)
+	log.info('*** OK: DNS cache.')
+
+
+if __name__ == '__main__':
+	with ucr_test.UCSTestConfigRegistry():
+		main()
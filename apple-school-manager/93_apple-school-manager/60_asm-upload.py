@@ -17,7 +17,7 @@ from univention.admin.uldap import getMachineConnection
 import univention.testing.strings as uts
 import univention.testing.ucr as ucr_test
 import univention.testing.utils as utils
-from univention.config_registry import handler_set
+from univention.config_registry import handler_set, handler_unset
 from univention.testing.ucsschool.importusers_cli_v2 import ImportTestbase
 
 
@@ -39,6 +39,7 @@ class LocalHostAsASM(object):
 			"asm/school_whitelist={}".format(self.school_name),
 			"auth/sshd/user/{}=yes".format(self.username),
 		])
+		handler_unset(["asm/last_upload_hash"])
 		os.rename("/etc/asm_public_key", "/etc/asm_public_key.backup_60test")
 		if os.path.exists("/etc/asm.secret"):
 			os.rename("/etc/asm.secret", "/etc/asm.secret.backup_60test")
@@ -117,10 +118,31 @@ class Test(ImportTestbase):
 					)
 					if not filecmp.cmp(zip_path, remote_path, shallow=False):
 						utils.fail("ZIP file was not correctly uploaded")
-					return
+					break
 			else:
 				utils.fail("Something with the upload seems to be broken.")
 
+			print("Executing {!r} again, data is unchanged...".format(cmd))
+			returncode, stdout, stderr = exec_cmd(cmd)
+			print("-> returncode={}".format(returncode))
+			print("-> stderr={}".format(stderr))
+			if returncode:
+				utils.fail("{!r} returned {}.)".format(cmd, returncode))
+			if "not uploading ZIP file" not in stderr:
+				utils.fail("Unchanged data was uploaded again.")
+			if "The uploaded zip is stored in: " in stderr:
+				utils.fail("ZIP file of unchanged data was reported as uploaded.")
+
+			cmd = ["/usr/sbin/asm-upload", "--upload-only"]
+			print("Executing {!r}, spool directory is empty...".format(cmd))
+			returncode, stdout, stderr = exec_cmd(cmd)
+			print("-> returncode={}".format(returncode))
+			print("-> stderr={}".format(stderr))
+			if returncode:
+				utils.fail("{!r} returned {}.)".format(cmd, returncode))
+			if "No ZIP file waiting for upload" not in stderr:
+				utils.fail("Expected no ZIP file in the spool directory after successful uploads.")
+
 
 if __name__ == "__main__":
 	test = Test()
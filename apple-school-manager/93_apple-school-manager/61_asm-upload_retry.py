@@ -0,0 +1,194 @@
+#!/usr/share/ucs-test/runner python
+## -*- coding: utf-8 -*-
+## desc: test retrying failed uploads and keeping and reusing their ZIP files
+## tags: [apptest]
+## exposure: dangerous
+## packages:
+##   - univention-apple-school-manager-connector
+
+import itertools
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+import paramiko
+from paramiko.ssh_exception import AuthenticationException, BadHostKeyException, SSHException
+import univention.testing.ucr as ucr_test
+import univention.testing.utils as utils
+from univention.config_registry import handler_set, handler_unset
+
+from univention.asm.asm_upload import ASMUpload
+from univention.asm.spool import UploadSpool
+from univention.asm.utils import update_ucr
+
+logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger('main')
+
+
+class FakeUpload(ASMUpload):
+	"""
+	Raises the exceptions in `errors`, one per upload attempt, then succeeds.
+	New ZIP files contain random data instead of the LDAP data.
+	"""
+
+	def __init__(self, errors):
+		super(FakeUpload, self).__init__('username', 'password')
+		self.errors = iter(errors)
+		self.attempts = 0
+		self.created = []
+
+	def _create_zip(self, spool):
+		zip_path = write_zip(spool)
+		self.created.append(zip_path)
+		return zip_path, spool.add(zip_path, 'new_hash')
+
+	def _upload_file(self, zip_path):
+		self.attempts += 1
+		error = next(self.errors, None)
+		if error:
+			raise error
+
+
+def write_zip(spool):
+	zip_path = spool.new_zip_path()
+	with open(zip_path, 'wb') as fp:
+		fp.write(os.urandom(1024))
+	return zip_path
+
+
+def spool_zip(folder_path, content_hash):
+	spool = UploadSpool(os.path.join(folder_path, 'spool'))
+	zip_path = write_zip(spool)
+	spool.add(zip_path, content_hash)
+	return spool, zip_path
+
+
+def upload(folder_path, errors, expected_exception=None, upload_only=True):
+	update_ucr()  # see asm/last_upload_hash set by previous uploads
+	fake = FakeUpload(errors)
+	try:
+		if upload_only:
+			fake.upload_only(folder_path)
+		else:
+			fake.upload(folder_path)
+	except Exception as exc:
+		if not expected_exception or not isinstance(exc, expected_exception):
+			raise
+		log.info('Upload failed as expected: %r', exc)
+	else:
+		if expected_exception:
+			utils.fail('Upload did not fail with {}.'.format(expected_exception.__name__))
+	return fake
+
+
+def test_transient_errors(folder_path):
+	log.info('*** Upload succeeds after transient errors.')
+	spool, zip_path = spool_zip(folder_path, 'hash1')
+	errors = [socket.error('Connection reset by peer'), SSHException('Error reading SSH protocol banner')]
+	fake = upload(folder_path, errors)
+	if fake.attempts != 3:
+		utils.fail('Expected 3 upload attempts, got {}.'.format(fake.attempts))
+	if not fake.uploaded:
+		utils.fail('Upload was not reported as done.')
+	if spool.get_all() or os.path.exists(zip_path):
+		utils.fail('ZIP file was not removed from the spool directory after the upload.')
+
+
+def test_persistent_errors(folder_path):
+	log.info('*** Upload fails until the time budget is used up, ZIP file is kept.')
+	spool, zip_path = spool_zip(folder_path, 'hash2')
+	fake = upload(folder_path, itertools.repeat(socket.error('Connection refused')), socket.error)
+	if fake.attempts < 2:
+		utils.fail('Upload was not retried, {} attempts.'.format(fake.attempts))
+	spooled = spool.get_newest()
+	if not spooled or spooled[0] != zip_path or not os.path.exists(zip_path):
+		utils.fail('ZIP file of failed upload was not kept in the spool directory.')
+	metadata = spooled[1]
+	if metadata.get('attempts') != fake.attempts:
+		utils.fail('Expected {} failed attempts in metadata, got {!r}.'.format(fake.attempts, metadata.get('attempts')))
+	if 'Connection refused' not in metadata.get('last_error', ''):
+		utils.fail('Last error missing in metadata: {!r}'.format(metadata))
+
+	log.info('*** Kept ZIP file is uploaded with the next run.')
+	fake = upload(folder_path, [])
+	if fake.attempts != 1 or not fake.uploaded:
+		utils.fail('Kept ZIP file was not uploaded ({} attempts).'.format(fake.attempts))
+	if spool.get_all():
+		utils.fail('ZIP file was not removed from the spool directory after the upload.')
+
+
+def test_non_retryable_errors(folder_path):
+	key1 = paramiko.RSAKey.generate(1024)
+	key2 = paramiko.RSAKey.generate(1024)
+	for error in (
+			AuthenticationException('Authentication failed.'),
+			BadHostKeyException('upload.appleschoolcontent.com', key1, key2),
+	):
+		log.info('*** %s is not retried, ZIP file is kept.', error.__class__.__name__)
+		spool, zip_path = spool_zip(folder_path, 'hash3')
+		fake = upload(folder_path, itertools.repeat(error), error.__class__)
+		if fake.attempts != 1:
+			utils.fail('{} was retried, {} attempts.'.format(error.__class__.__name__, fake.attempts))
+		if not os.path.exists(zip_path) or spool.get_newest()[0] != zip_path:
+			utils.fail('ZIP file of failed upload was not kept in the spool directory.')
+		spool.remove(zip_path)
+
+
+def test_unchanged_data(folder_path):
+	log.info('*** ZIP file with unchanged data is not uploaded.')
+	spool, zip_path = spool_zip(folder_path, 'hash1')
+	handler_set(['asm/last_upload_hash=hash1'])
+	fake = upload(folder_path, [])
+	if fake.attempts or fake.uploaded:
+		utils.fail('Unchanged data was uploaded.')
+	if spool.get_all():
+		utils.fail('ZIP file was not removed from the spool directory.')
+
+
+def test_reuse_spooled_zip(folder_path):
+	log.info('*** ZIP file of a failed upload is uploaded instead of creating a new one.')
+	spool, zip_path = spool_zip(folder_path, 'hash4')
+	fake = upload(folder_path, [], upload_only=False)
+	if fake.created:
+		utils.fail('New ZIP file was created, although a recent one was spooled.')
+	if fake.attempts != 1 or not fake.uploaded or os.path.exists(zip_path):
+		utils.fail('Spooled ZIP file was not uploaded ({} attempts).'.format(fake.attempts))
+
+	log.info('*** A new ZIP file is created, if the spooled one is too old.')
+	spool, zip_path = spool_zip(folder_path, 'hash5')
+	zip_path, metadata = spool.get_newest()
+	metadata['created'] = time.time() - 7200
+	spool.update(zip_path, metadata)
+	fake = upload(folder_path, [], upload_only=False)
+	if len(fake.created) != 1 or fake.attempts != 1 or not fake.uploaded:
+		utils.fail('No new ZIP file was created and uploaded ({} attempts).'.format(fake.attempts))
+	if spool.get_all() or os.path.exists(zip_path):
+		utils.fail('Outdated ZIP file was not removed from the spool directory.')
+
+
+def main():
+	handler_set([
+		'asm/upload/retry/time_budget=1',
+		'asm/upload/retry/delay=0.05',
+		'asm/upload/retry/max_delay=0.2',
+		'asm/upload/spool/max_age=3600',
+	])
+	handler_unset(['asm/last_upload_hash'])
+	folder_path = tempfile.mkdtemp()
+	try:
+		test_transient_errors(folder_path)
+		test_persistent_errors(folder_path)
+		test_non_retryable_errors(folder_path)
+		test_unchanged_data(folder_path)
+		test_reuse_spooled_zip(folder_path)
+	finally:
+		shutil.rmtree(folder_path)
+	log.info('*** OK: upload retries and spool.')
+
+
+if __name__ == '__main__':
+	with ucr_test.UCSTestConfigRegistry():
+		main()
@@ -0,0 +1,266 @@
+#!/usr/bin/python2.7
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the SFTP upload (not packaged, results in sftp_upload_benchmark.txt).
+
+Uploads a file of random data with :py:meth:`SFTP.upload()`, with
+:py:meth:`paramiko.SFTPClient.put()` (the upload before `asm/sftp/*` existed)
+and with the :py:meth:`paramiko.SFTPClient.putfo()` fallback of
+:py:meth:`SFTP.upload()` to a local paramiko SFTP server. The server is
+reached through a proxy that delays all data by half the round trip time,
+to simulate the latency of the connection to Apple School Manager.
+
+	./sftp_upload_benchmark.py --size 8 --rtt 0 50 200
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from Queue import Queue
+
+import paramiko
+
+from univention.asm.network.sftp_upload import SFTP
+
+USERNAME = 'asm'
+PASSWORD = 'secret'
+
+
+class _ServerInterface(paramiko.ServerInterface):
+	def get_allowed_auths(self, username):
+		return 'password'
+
+	def check_auth_password(self, username, password):
+		if (username, password) == (USERNAME, PASSWORD):
+			return paramiko.AUTH_SUCCESSFUL
+		return paramiko.AUTH_FAILED
+
+	def check_channel_request(self, kind, chanid):
+		if kind == 'session':
+			return paramiko.OPEN_SUCCEEDED
+		return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+	def stat(self):
+		return paramiko.SFTPAttributes.from_stat(os.fstat(self.writefile.fileno()))
+
+
+class _SFTPServerInterface(paramiko.SFTPServerInterface):
+	"""Stores uploaded files in `root`, supports only what the uploads need."""
+
+	def __init__(self, server, root):
+		super(_SFTPServerInterface, self).__init__(server)
+		self.root = root
+
+	def _path(self, path):
+		return os.path.join(self.root, os.path.basename(path))
+
+	def open(self, path, flags, attr):
+		try:
+			fd = os.open(self._path(path), flags, 0o600)
+		except OSError as exc:
+			return paramiko.SFTPServer.convert_errno(exc.errno)
+		handle = _SFTPHandle(flags)
+		handle.filename = path
+		handle.writefile = os.fdopen(fd, 'wb')
+		return handle
+
+	def stat(self, path):
+		try:
+			return paramiko.SFTPAttributes.from_stat(os.stat(self._path(path)))
+		except OSError as exc:
+			return paramiko.SFTPServer.convert_errno(exc.errno)
+
+	lstat = stat
+
+
+def _start_thread(target, *args):
+	thread = threading.Thread(target=target, args=args)
+	thread.daemon = True
+	thread.start()
+	return thread
+
+
+def _listen():
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	listener.bind(('127.0.0.1', 0))
+	listener.listen(5)
+	return listener
+
+
+def start_sftp_server(host_key, root):
+	"""
+	Start an SFTP server on localhost, that stores uploaded files in `root`.
+
+	:return: port of the server
+	:rtype: int
+	"""
+	listener = _listen()
+
+	def serve():
+		while True:
+			sock, addr = listener.accept()
+			transport = paramiko.Transport(sock)
+			transport.add_server_key(host_key)
+			transport.set_subsystem_handler('sftp', paramiko.SFTPServer, _SFTPServerInterface, root)
+			transport.start_server(server=_ServerInterface())
+
+	_start_thread(serve)
+	return listener.getsockname()[1]
+
+
+def start_latency_proxy(target_port, rtt):
+	"""
+	Start a TCP proxy on localhost to `target_port`, that delays the data in
+	each direction by `rtt / 2` seconds.
+
+	:return: port of the proxy
+	:rtype: int
+	"""
+	listener = _listen()
+
+	def receive(src, queue):
+		while True:
+			try:
+				data = src.recv(65536)
+			except socket.error:
+				data = b''
+			queue.put((time.time() + rtt / 2.0, data))
+			if not data:
+				return
+
+	def send(dst, queue):
+		while True:
+			due, data = queue.get()
+			time.sleep(max(0.0, due - time.time()))
+			try:
+				if not data:
+					dst.shutdown(socket.SHUT_WR)
+					return
+				dst.sendall(data)
+			except socket.error:
+				return
+
+	def serve():
+		while True:
+			client, addr = listener.accept()
+			server = socket.create_connection(('127.0.0.1', target_port))
+			for src, dst in ((client, server), (server, client)):
+				queue = Queue()
+				_start_thread(receive, src, queue)
+				_start_thread(send, dst, queue)
+
+	_start_thread(serve)
+	return listener.getsockname()[1]
+
+
+def upload_with_put(sftp, filename):
+	sftp.sftpClient.put(filename, '/archive.zip', confirm=False)
+
+
+def upload_with_upload(sftp, filename):
+	sftp.upload(filename)
+
+
+def upload_with_putfo_fallback(sftp, filename):
+	sftp._can_limit_requests = lambda: False
+	sftp.upload(filename)
+
+
+METHODS = (
+	('put()', upload_with_put),
+	('upload()', upload_with_upload),
+	('upload() with putfo()', upload_with_putfo_fallback),
+)
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description='Benchmark of the SFTP upload to a local SFTP server.')
+	parser.add_argument('--size', type=int, default=8, help='size of the uploaded file in MiB [%(default)s]')
+	parser.add_argument(
+		'--rtt', type=int, nargs='+', default=[0, 50, 200], help='round trip times in ms to test [%(default)s]')
+	parser.add_argument('--repeat', type=int, default=3, help='uploads per method, the fastest counts [%(default)s]')
+	parser.add_argument('--chunk-size', type=int, help='bytes per write request [asm/sftp/chunk_size]')
+	parser.add_argument('--max-requests', type=int, help='unacknowledged write requests [asm/sftp/max_requests]')
+	parser.add_argument('--window-size', type=int, help='window size of the SSH channel [asm/sftp/window_size]')
+	parser.add_argument(
+		'--max-packet-size', type=int, help='maximum packet size of the SSH channel [asm/sftp/max_packet_size]')
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	logging.basicConfig(level=logging.WARNING)
+	tmp_dir = tempfile.mkdtemp()
+	try:
+		filename = os.path.join(tmp_dir, 'upload.zip')
+		with open(filename, 'wb') as fp:
+			for _ in range(args.size):
+				fp.write(os.urandom(1024 * 1024))
+		size = os.path.getsize(filename)
+		root = os.path.join(tmp_dir, 'server')
+		os.mkdir(root)
+		host_key = paramiko.RSAKey.generate(2048)
+		server_port = start_sftp_server(host_key, root)
+		print('{:>8} {:<24} {:>10}'.format('RTT (ms)', 'method', 'KiB/s'))
+		for rtt in args.rtt:
+			port = start_latency_proxy(server_port, rtt / 1000.0) if rtt else server_port
+			host_key_line = '[127.0.0.1]:{} {} {}'.format(port, host_key.get_name(), host_key.get_base64())
+			for name, method in METHODS:
+				durations = []
+				for _ in range(args.repeat):
+					sftp = SFTP(
+						'127.0.0.1', USERNAME, PASSWORD, host_key_line, window_size=args.window_size,
+						max_packet_size=args.max_packet_size, chunk_size=args.chunk_size,
+						max_requests=args.max_requests, port=port)
+					with sftp:
+						start = time.time()
+						method(sftp, filename)
+						durations.append(time.time() - start)
+					uploaded = os.path.join(root, 'archive.zip')
+					assert os.path.getsize(uploaded) == size, 'Uploaded file has the wrong size.'
+					os.remove(uploaded)
+				print('{:>8} {:<24} {:>10.0f}'.format(rtt, name, size / 1024.0 / min(durations)))
+	finally:
+		shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+	main()
@@ -36,12 +36,21 @@ export school data to asm
 from __future__ import absolute_import
 import os
 import logging
+import random
+import socket
+import time
 from datetime import datetime
 
+from paramiko.ssh_exception import AuthenticationException, BadHostKeyException, SSHException
+
 from .csv.zip_file import AsmZipFile
 from .network.sftp_upload import SFTP
+from .spool import UploadSpool
+from .utils import get_ucr, get_upload_retry_settings, get_upload_spool_max_age
 from univention.config_registry import handler_set
 
+UCR_LAST_UPLOAD_HASH_KEY = 'asm/last_upload_hash'
+
 
 class ASMUpload(object):
 
@@ -53,21 +62,111 @@ class ASMUpload(object):
 		self.password = password
 		self.ou_whitelist = ou_whitelist
 		self.delete_zip_file = delete_zip_file
+		self.uploaded = False  # whether the last upload()/upload_only() call uploaded a ZIP file
 		self.logger = logging.getLogger(__name__)
 
-	def upload(self, folder_path="/var/lib/asm"):
-		file_path = os.path.join(folder_path, "asm_{}.zip".format(datetime.isoformat(datetime.now())))
-		zip_path = AsmZipFile(file_path, self.ou_whitelist).write_zip()
+	def upload(self, folder_path="/var/lib/asm", force=False):
+		"""
+		Create a ZIP file in the spool directory and upload it.
+
+		If the upload fails, the ZIP file is left in the spool directory and
+		can be uploaded with :py:meth:`upload_only()`. If such a ZIP file is
+		not older than `asm/upload/spool/max_age` seconds (see
+		:py:func:`get_upload_spool_max_age()`), it is uploaded instead of
+		creating a new one.
+		"""
+		spool = UploadSpool(os.path.join(folder_path, "spool"))
+		spooled = spool.get_newest()
+		if spooled and time.time() - spooled[1]['created'] <= get_upload_spool_max_age():
+			zip_path, metadata = spooled
+			self.logger.info(
+				'Uploading ZIP file %s of a failed upload from %s instead of creating a new one.',
+				zip_path, datetime.isoformat(datetime.fromtimestamp(metadata['created']))
+			)
+		else:
+			zip_path, metadata = self._create_zip(spool)
+		return self._upload_spooled(spool, zip_path, metadata, folder_path, force)
+
+	def upload_only(self, folder_path="/var/lib/asm", force=False):
+		"""
+		Upload the newest ZIP file from the spool directory, without creating
+		a new one.
+		"""
+		spool = UploadSpool(os.path.join(folder_path, "spool"))
+		spooled = spool.get_newest()
+		if not spooled:
+			self.logger.info('No ZIP file waiting for upload in %s.', spool.path)
+			return None
+		zip_path, metadata = spooled
+		self.logger.info(
+			'Found ZIP file %s from %s (%d failed upload attempts).',
+			zip_path, datetime.isoformat(datetime.fromtimestamp(metadata['created'])), metadata.get('attempts', 0)
+		)
+		return self._upload_spooled(spool, zip_path, metadata, folder_path, force)
+
+	def _create_zip(self, spool):
+		zip_file = AsmZipFile(spool.new_zip_path(), self.ou_whitelist)
+		zip_path = zip_file.write_zip()
+		return zip_path, spool.add(zip_path, zip_file.content_hash)
+
+	def _upload_spooled(self, spool, zip_path, metadata, folder_path, force):
+		self.uploaded = False
+		ucr = get_ucr()
+		if not force and metadata['content_hash'] == ucr.get(UCR_LAST_UPLOAD_HASH_KEY):
+			self.logger.info(
+				'Data has not changed since the last upload (%s), not uploading ZIP file.', ucr.get('asm/last_upload')
+			)
+		else:
+			self._upload_with_retry(spool, zip_path, metadata)
+			self.uploaded = True
+			handler_set([
+				"asm/last_upload={}".format(datetime.isoformat(datetime.now())),
+				"{}={}".format(UCR_LAST_UPLOAD_HASH_KEY, metadata['content_hash']),
+			])
+		if self.delete_zip_file:
+			spool.remove(zip_path)
+			self.logger.debug('Deleted ZIP file.')
+		else:
+			stored_path = os.path.join(folder_path, os.path.basename(zip_path))
+			os.rename(zip_path, stored_path)
+			spool.remove(zip_path)
+			return stored_path
+
+	def _upload_with_retry(self, spool, zip_path, metadata):
+		"""
+		Upload the ZIP file, retrying after network errors with exponential
+		backoff and jitter (see :py:func:`get_upload_retry_settings()`) until
+		the time budget is used up. Failed attempts are recorded in the
+		metadata in the spool directory.
+		"""
+		time_budget, delay, max_delay = get_upload_retry_settings()
+		deadline = time.time() + time_budget
+		attempt = 0
+		while True:
+			try:
+				self._upload_file(zip_path)
+				return
+			except (AuthenticationException, BadHostKeyException):
+				raise  # retrying won't help
+			except (SSHException, socket.error) as exc:
+				attempt += 1
+				metadata['attempts'] = metadata.get('attempts', 0) + 1
+				metadata['last_error'] = str(exc)
+				spool.update(zip_path, metadata)
+				wait = random.uniform(0, min(max_delay, delay * 2 ** (attempt - 1)))
+				if time.time() + wait > deadline:
+					self.logger.error(
+						'Upload failed %d times, giving up. The ZIP file is kept in %s, use "asm-upload --upload-only" '
+						'to upload it.', attempt, spool.path
+					)
+					raise
+				self.logger.warning('Upload attempt %d failed: %s. Retrying in %.1f seconds...', attempt, exc, wait)
+				time.sleep(wait)
+
+	def _upload_file(self, zip_path):
 		self.logger.info('Uploading ZIP file to %s...', self.hostname)
 		with SFTP(self.hostname, self.username, self.password, self.host_key_line) as sftp:
 			self.logger.debug('Connected to %s.', self.hostname)
 			sftp.upload(zip_path)
 			self.logger.info('Finished uploading ZIP file.')
-
 		self.logger.debug('Disconnected.')
-		handler_set(["asm/last_upload={}".format(datetime.isoformat(datetime.now()))])
-		if self.delete_zip_file:
-			os.remove(zip_path)
-			self.logger.debug('Deleted ZIP file.')
-		else:
-			return zip_path
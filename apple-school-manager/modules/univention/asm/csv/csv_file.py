@@ -39,29 +39,34 @@ Data in CSV files is always sorted by 1) school and 2) user/class name.
 
 from __future__ import absolute_import, unicode_literals
 
-import json
+import collections
+import itertools
 import logging
 import os
-from operator import attrgetter
+import re
+import threading
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from operator import itemgetter
 
-from ucsschool.importer.writer.csv_writer import CsvWriter
-from ucsschool.importer.writer.result_exporter import ResultExporter
-from ucsschool.lib.models.group import SchoolClass, WorkGroup
 from ucsschool.lib.models.school import School
-from ucsschool.lib.models.user import Student, Teacher
-from univention.admin import uexceptions
 from univention.asm.models.classes import AsmClass
 from univention.asm.models.course import AsmCourse
 from univention.asm.models.location import AsmLocation
 from univention.asm.models.roster import AsmRoster
-from univention.asm.models.staff import AsmStaff, get_filtered_staff
+from univention.asm.models.staff import AsmStaff
 
 from univention.asm.models.student import AsmStudent
-from ..utils import get_ldap_connection, get_ucr
+from ..snapshot import DirectorySnapshot
+from ..utils import (
+	get_csv_processes, get_csv_workers, get_ldap_connection, get_new_ldap_connection, get_ucr, get_zip_compression,
+	join_dns_threads
+)
 
 try:
-	from typing import Any, AnyStr, Iterable, Iterator, Optional
+	from typing import Any, AnyStr, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Type
 	from univention.asm.models.base import AsmModel
+	from ucsschool.importer.utils.ldap_connection import LoType
 except ImportError:
 	pass
 
@@ -71,53 +76,129 @@ __all__ = (
 	'AsmStaffCsvFile', 'AsmStudentsCsvFile', 'create_csv_files'
 )
 
+_shard_job = None  # (AsmCsvFile, role, AsmModel class) set in parent process before starting the worker processes
+
+
+def _init_shard_worker():  # type: () -> None
+	# don't use the LDAP connection inherited from the parent process
+	lo, po = get_new_ldap_connection()
+	_shard_job[0].snapshot.use_connection(lo)
+
+
+def _create_shard_objects(users):  # type: (List[Tuple[AnyStr, AnyStr, AnyStr]]) -> List[AsmModel]
+	csv_file, role, asm_model_class = _shard_job
+	return [csv_file.create_user_object(dn, role, asm_model_class) for school, name, dn in users]
 
-class _AsmCsvWriter(ResultExporter):
+
+def _iter_shards(users, shard_size):
+	# type: (Iterable[Tuple[AnyStr, AnyStr, AnyStr]], int) -> Iterator[List[Tuple[AnyStr, AnyStr, AnyStr]]]
+	for school, school_users in itertools.groupby(users, key=itemgetter(0)):
+		while True:
+			shard = list(itertools.islice(school_users, shard_size))
+			if not shard:
+				break
+			yield shard
+
+
+class _AsmCsvWriter(object):
 	"""
 	CSV file writer.
+
+	Writes the same bytes as :py:class:`csv.writer` with the `excel` dialect
+	and UTF-8 encoded values (quoting only where needed, `\\r\\n` line
+	endings), but gets the values of each object as a list from the row
+	extractor of its class (see
+	:py:meth:`univention.asm.models.base.AsmModel.get_row_extractor()`) and
+	encodes each line at once. Lines are collected and written in chunks of
+	about :py:attr:`buffer_size` bytes.
 	"""
 
-	def __init__(self, header, *arg, **kwargs):  # type: (Iterable[AnyStr], *Any, **Any) -> None
-		self.header = header
-		super(_AsmCsvWriter, self).__init__(*arg, **kwargs)
+	buffer_size = 1024 * 1024
+	_needs_quotes = re.compile('[",\r\n]').search
+
+	def __init__(self, header):  # type: (Iterable[AnyStr]) -> None
+		self.header = list(header)
+		self._row_extractors = {}  # type: Dict[Type[AsmModel], Callable[[AsmModel], List[Any]]]
 
 	def get_header(self):  # type: () -> Iterable[AnyStr]
 		"""
-		Data for an optional header (line) before the main data.
+		Data for the header line before the main data.
 
-		:return: object that can be used by the writer to create a header
+		:return: CSV header as list of strings
+		:rtype: list(str)
 		"""
 		return self.header
 
-	def get_iter(self, objs):  # type: (Iterable[AsmModel]) -> Iterable[AsmModel]
+	def dump(self, objs, filename):  # type: (Iterable[AsmModel], AnyStr) -> None
 		"""
-		Iterator over relevant objects.
+		Write header and objects to the file `filename`.
 
-		:param objs: list of AsmModel objects
-		:return: iterator for AsmModel objects
-		:rtype: Iterator
+		:param objs: AsmModel objects to write
+		:param str filename: path of the file to write
 		"""
-		return objs
+		with open(filename, 'wb') as fp:
+			self.dump_to_file(objs, fp)
 
-	def get_writer(self):  # type: () -> CsvWriter
+	def dump_to_file(self, objs, fp):  # type: (Iterable[AsmModel], Any) -> None
 		"""
-		Object that will write the data to disk in the desired format.
+		Write header and objects to the file object `fp`.
 
-		:return: an object of a BaseWriter subclass
-		:rtype: BaseWriter
+		:param objs: AsmModel objects to write
+		:param fp: file object opened for writing bytes
 		"""
-		return CsvWriter(field_names=self.get_header())
-
-	def serialize(self, obj):  # type: (AsmModel) -> Iterator[str]
+		header = self.get_header()
+		format_line = self.format_line
+		buf = [format_line(header)]
+		buffered = len(buf[0])
+		for obj in objs:
+			line = format_line(self.serialize(obj))
+			buf.append(line)
+			buffered += len(line)
+			if buffered >= self.buffer_size:
+				fp.write(b''.join(buf))
+				buf = []
+				buffered = 0
+		fp.write(b''.join(buf))
+
+	def serialize(self, obj):  # type: (AsmModel) -> List[Any]
 		"""
-		Make a dict of attr_name->strings from an object delivered by the
-		iterator from get_iter().
+		Get the values of an object in the order of the CSV header.
 
 		:param AsmModel obj: object to serialize
-		:return: attr_name->strings that will be used to write the output file
-		:rtype: dict
+		:return: values of the CSV line
+		:rtype: list
 		"""
-		return obj.as_dict()
+		try:
+			extractor = self._row_extractors[obj.__class__]
+		except KeyError:
+			extractor = self._row_extractors[obj.__class__] = obj.get_row_extractor(self.header)
+		return extractor(obj)
+
+	@classmethod
+	def format_line(cls, values):  # type: (Iterable[Any]) -> bytes
+		"""
+		Format values as a CSV line.
+
+		:param values: values of the line
+		:return: UTF-8 encoded CSV line, including line ending
+		:rtype: bytes
+		"""
+		needs_quotes = cls._needs_quotes
+		fields = []
+		for value in values:
+			if not isinstance(value, unicode):
+				if isinstance(value, bytes):
+					value = value.decode('utf-8')
+				elif isinstance(value, float):
+					value = repr(value)  # like the csv module
+				else:
+					value = unicode(value)
+			if needs_quotes(value):
+				value = '"{}"'.format(value.replace('"', '""'))
+			fields.append(value)
+		if len(fields) == 1 and not fields[0]:
+			fields[0] = '""'  # like the csv module, else the line would look empty
+		return ('{}\r\n'.format(','.join(fields))).encode('utf-8')
 
 
 class AsmCsvFile(object):
@@ -125,24 +206,42 @@ class AsmCsvFile(object):
 
 	header = ()
 	asm_model_class = None
-	ucs_classes = []
 	lo = None
 
-	def __init__(self, file_path, ou_whitelist=None):  # type: (AnyStr, Optional[Iterable[AnyStr]]) -> None
+	def __init__(self, file_path, ou_whitelist=None, snapshot=None):
+		# type: (AnyStr, Optional[Iterable[AnyStr]], Optional[DirectorySnapshot]) -> None
 		"""
 		:param str file_path: file path to write CSV to
 		:param ou_whitelist: list of schools/OUs that should be considered
 			when looking for LDAP objects. No limit if empty or None.
 		:type ou_whitelist: list(str) or None
+		:param DirectorySnapshot snapshot: LDAP data shared with other CSV file
+			generators of the same run, a new one will be created if unset
 		"""
 		self.file_path = file_path
 		self.ou_whitelist = ou_whitelist
 		self.obj = []
+		self._num_written = 0
 		self.logger = logging.getLogger(__name__)
 		self.ucr = get_ucr()
 		if not self.lo:
 			self.__class__.lo, po = get_ldap_connection()
-		self.limbo_ou = self._get_limbo_ou()
+		self._shared_snapshot = snapshot is not None
+		self.snapshot = snapshot or DirectorySnapshot(self.lo, ou_whitelist)
+
+	@property
+	def limbo_ou(self):  # type: () -> AnyStr
+		return self.snapshot.limbo_ou
+
+	def reset_snapshot(self):  # type: () -> None
+		"""
+		Discard LDAP data loaded by previous calls to
+		:py:meth:`find_and_create_objects()`, unless the snapshot is shared
+		with other CSV file generators.
+		"""
+		if not self._shared_snapshot:
+			self.snapshot.close()
+			self.snapshot = DirectorySnapshot(self.lo, self.ou_whitelist)
 
 	def find_and_create_objects(self):  # type: () -> Iterator[AsmModel]
 		"""
@@ -153,16 +252,105 @@ class AsmCsvFile(object):
 		"""
 		if not self.asm_model_class:
 			raise NotImplementedError()
+		self.reset_snapshot()
+		for school in self.get_schools():
+			for group in self.snapshot.get_groups(school.name):
+				yield self.asm_model_class.from_object(group, snapshot=self.snapshot)
 
-		schools = self.get_schools()
-		for school in schools:
-			ucs_objs = []
-			for ucs_class in self.ucs_classes:
-				ucs_objs.extend(ucs_class.get_all(self.lo, school.name))
-			if ucs_objs and hasattr(ucs_objs[0], 'name'):
-				ucs_objs.sort(key=attrgetter('name'))
-			for ucs_obj in ucs_objs:
-				yield self.asm_model_class.from_dn(ucs_obj.dn)
+	def create_user_object(self, dn, role, asm_model_class):  # type: (AnyStr, AnyStr, Type[AsmModel]) -> AsmModel
+		"""
+		Create an AsmStaff or AsmStudent object.
+
+		:param str dn: DN of the user
+		:param str role: `staff` or `students`
+		:param asm_model_class: AsmStaff or AsmStudent
+		:return: AsmModel object
+		:rtype: AsmModel
+		"""
+		user = self.snapshot.get_user(dn, role)
+		return asm_model_class.from_object(user, ou_whitelist=self.ou_whitelist, snapshot=self.snapshot)
+
+	def create_user_objects(self, role, asm_model_class):  # type: (AnyStr, Type[AsmModel]) -> Iterator[AsmModel]
+		"""
+		Create AsmStaff or AsmStudent objects for all users with role `role`,
+		sorted by 1) school and 2) username.
+
+		If UCR variable `asm/csv/processes` is larger than 1 (and neither
+		`asm/csv/workers` nor `asm/zip/compression_threads` are, as the
+		processes are forked), the users are split into shards (by school,
+		large schools by username range) which are processed in a pool of
+		worker processes. The shards are created while the workers consume
+		them, and as they are contiguous ranges of the sorted users, their
+		results are returned in the order of the shards. At most twice as
+		many shards as processes are sent to the workers before their objects
+		have been consumed, so the results waiting in the parent process
+		don't grow with the number of users.
+
+		The LDAP attributes of the users are dropped from the snapshot once
+		their objects have been created (see
+		:py:meth:`DirectorySnapshot.drop_attrs()`).
+
+		:param str role: `staff` or `students`
+		:param asm_model_class: AsmStaff or AsmStudent
+		:return: iterator over AsmModel objects
+		:rtype: Iterator
+		"""
+		users = self.snapshot.get_users(role)
+		processes, shard_size = get_csv_processes()
+		if processes > 1 and len(users) > shard_size:
+			if get_csv_workers() > 1 or get_zip_compression()[1] > 1:
+				# forking while other threads run could leave locks held by them locked in the workers
+				self.logger.warning(
+					'Not using worker processes, because asm/csv/workers or asm/zip/compression_threads is set.')
+			else:
+				for obj in self._create_user_objects_in_processes(role, asm_model_class, users, processes, shard_size):
+					yield obj
+				return
+		for school, name, dn in users:
+			obj = self.create_user_object(dn, role, asm_model_class)
+			self.snapshot.drop_attrs(dn)
+			yield obj
+
+	def _create_user_objects_in_processes(self, role, asm_model_class, users, processes, shard_size):
+		# type: (AnyStr, Type[AsmModel], Iterable[Tuple[AnyStr, AnyStr, AnyStr]], int, int) -> Iterator[AsmModel]
+		global _shard_job
+		self.logger.info(
+			'Creating %d %s in shards of up to %d users with %d processes...', len(users), role, shard_size, processes)
+		# everything the workers need is loaded before they are forked
+		self.snapshot.check_mail_domains()
+		join_dns_threads()
+		_shard_job = (self, role, asm_model_class)
+		shards = collections.deque()  # shards sent to the workers, in order
+		window = threading.Semaphore(2 * processes)  # shards sent to the workers and not consumed yet
+		aborted = threading.Event()
+
+		def iter_shards():  # type: () -> Iterator[List[Tuple[AnyStr, AnyStr, AnyStr]]]
+			# runs in the task handler thread of the pool
+			for shard in _iter_shards(users, shard_size):
+				window.acquire()
+				if aborted.is_set():
+					return
+				shards.append(shard)
+				yield shard
+
+		pool = Pool(processes, initializer=_init_shard_worker)
+		try:
+			for objs in pool.imap(_create_shard_objects, iter_shards(), chunksize=1):
+				for school, name, dn in shards.popleft():
+					self.snapshot.drop_attrs(dn)
+				for obj in objs:
+					yield obj
+				window.release()
+			pool.close()
+		except BaseException:
+			# terminate() waits for the task handler thread
+			aborted.set()
+			window.release()
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
+			_shard_job = None
 
 	def get_schools(self):  # type: () -> Iterable[School]
 		"""
@@ -171,80 +359,61 @@ class AsmCsvFile(object):
 		:return list of School objects
 		:rtype: list(School)
 		"""
-		schools = [s for s in School.get_all(self.lo) if s.name != self.limbo_ou]
-		if self.ou_whitelist:
-			schools = [s for s in schools if s.name in self.ou_whitelist]
-		return sorted(schools, key=attrgetter('name'))
+		return self.snapshot.schools
+
+	def get_header(self):  # type: () -> Iterable[AnyStr]
+		"""
+		Get the header of the CSV file before the objects are created. It must
+		be at least as long as the longest header of all objects.
+
+		This default implementation returns the header of the model, for
+		models without a variable number of columns.
+
+		:return: CSV header as list of strings
+		:rtype: list(str)
+		"""
+		return self.header
 
-	def write_csv(self, objs=None):  # type: (Optional[Iterable[AsmModel]]) -> None
+	def write_csv(self, objs=None, fp=None):  # type: (Optional[Iterable[AsmModel]], Optional[Any]) -> None
 		"""
-		Write CSV to `self.file_path`.
+		Write CSV to `self.file_path` or to the file object `fp`.
+
+		If neither `objs` nor `self.obj` are set, the objects created by
+		:py:meth:`find_and_create_objects()` are written while they are
+		created, with the header from :py:meth:`get_header()`.
 
 		:param objs: optional list of AsmModel objects, if not set `self.objs` will be used
 		:type objs: list(AsmModel) or None
+		:param fp: optional file object (opened for writing bytes) to write
+			to instead of `self.file_path`
 		"""
-		objs = objs or self.obj or self.find_and_create_objects()
-		# walk through list (iterator really) and find longest header, because it's needed as first line
-		res = []
-		for obj in objs:
-			res.append(obj)
-			if len(obj.header) > len(self.header):
-				self.header = obj.header
+		objs = objs or self.obj
+		if objs:
+			# walk through list (iterator really) and find longest header, because it's needed as first line
+			objs = list(objs)
+			for obj in objs:
+				if len(obj.get_header()) > len(self.header):
+					self.header = obj.get_header()
+		else:
+			objs = self.find_and_create_objects()
+			first_obj = next(objs, None)  # starting the generator resets the snapshot
+			self.header = self.get_header()
+			objs = itertools.chain([first_obj] if first_obj is not None else [], objs)
 		orcw = _AsmCsvWriter(self.header)
-		self.logger.info('Writing %d objects to %s...', len(res), os.path.basename(self.file_path))
-		orcw.dump(res, self.file_path)
-
-	def _get_limbo_ou(self):  # type: () -> AnyStr
-		"""
-		Get the "limbo_ou", in case we have a "Single source database, partial
-		import user import" scenario.
-
-		:return: name or limbo OU or empty string
-		:rtype: str
-		"""
-		# Not using the importer code to get the import configuration object,
-		# because that would trigger the configuration checks, and the import
-		# might not be configured properly.
-
-		school_names = [s.name for s in School.get_all(self.lo)]
-		config_files = [
-			'/usr/share/ucs-school-import/configs/global_defaults.json',
-			'/var/lib/ucs-school-import/configs/global.json',
-			'/usr/share/ucs-school-import/configs/user_import_defaults.json',
-			'/var/lib/ucs-school-import/configs/user_import.json',
-			'/usr/share/ucs-school-import/configs/user_import_sisopi.json'
-		] + ['/var/lib/ucs-school-import/configs/{}.json'.format(ou) for ou in school_names]
-		config_files = [cf for cf in config_files if os.path.exists(cf)]
-		config_files.reverse()  # search from most specific (OU) to most general (defaults)
-		for config_file in config_files:
-			with open(config_file, 'rb') as fp:
-				config = json.load(fp)
-				try:
-					return config['limbo_ou']
-				except KeyError:
-					pass
-		return ''
-
-	def get_staff(self, school):  # type: (School) -> Iterable[Teacher]
-		return get_filtered_staff(self.lo, self.logger, school.name)
-
-	def get_students(self, school):  # type: (School) -> Iterable[Student]
-		global_ldap_filter_str = self.ucr.get("asm/ldap_filter/students", "")
-		specific_ldap_filter = self.ucr.get(
-			"asm/ldap_filter/students/{}".format(school.name), global_ldap_filter_str
-		)
-		try:
-			return [
-				student
-				for student in Student.get_all(self.lo, school.name, filter_str=specific_ldap_filter)
-				if not student.is_exam_student(self.lo)
-			]
-		except uexceptions.valueInvalidSyntax:
-			self.logger.error("Invalid LDAP-filter for students: {!r}".format(specific_ldap_filter))
-			raise
-		except Exception as exc:
-			self.logger.exception("other exc: %s", exc)
-			raise
+		self.logger.info('Writing %s...', os.path.basename(self.file_path))
+		self._num_written = 0
+		if fp:
+			orcw.dump_to_file(self._check_header(objs), fp)
+		else:
+			orcw.dump(self._check_header(objs), self.file_path)
+		self.logger.info('Wrote %d objects to %s.', self._num_written, os.path.basename(self.file_path))
+
+	def _check_header(self, objs):  # type: (Iterable[AsmModel]) -> Iterator[AsmModel]
+		for obj in objs:
+			if len(obj.get_header()) > len(self.header):
+				raise RuntimeError('Header of {!r} is longer than CSV header {!r}.'.format(obj, self.header))
+			self._num_written += 1
+			yield obj
 
 
 class AsmClassCsvFile(AsmCsvFile):
@@ -252,7 +421,24 @@ class AsmClassCsvFile(AsmCsvFile):
 
 	header = AsmClass.header
 	asm_model_class = AsmClass
-	ucs_classes = [SchoolClass, WorkGroup]
+
+	def get_header(self):  # type: () -> Iterable[AnyStr]
+		"""
+		Get the header of the CSV file, with as many `instructor_id_N` columns
+		as the class with the most instructors needs.
+
+		:return: CSV header as list of strings
+		:rtype: list(str)
+		"""
+		num_instructors = 0
+		for school in self.get_schools():
+			expected_teachers = self.snapshot.get_school_person_ids('staff', school.name)
+			for group in self.snapshot.get_groups(school.name):
+				num_instructors = max(
+					num_instructors, sum(1 for user_dn in group.users if user_dn in expected_teachers)
+				)
+		num_instructors = min(num_instructors, 15)
+		return list(self.header) + ['instructor_id_{}'.format(num) for num in range(4, num_instructors + 1)]
 
 
 class AsmCoursesCsvFile(AsmCsvFile):
@@ -260,7 +446,6 @@ class AsmCoursesCsvFile(AsmCsvFile):
 
 	header = AsmCourse.header
 	asm_model_class = AsmCourse
-	ucs_classes = [SchoolClass, WorkGroup]
 
 
 class AsmLocationsCsvFile(AsmCsvFile):
@@ -275,9 +460,9 @@ class AsmLocationsCsvFile(AsmCsvFile):
 		:return list of AsmModel objects
 		:rtype: list(AsmLocation)
 		"""
-		schools = self.get_schools()
-		for school in schools:
-			yield AsmLocation.from_dn(school.dn)
+		self.reset_snapshot()
+		for school in self.get_schools():
+			yield AsmLocation.from_object(school)
 
 
 class AsmRostersCsvFile(AsmCsvFile):
@@ -292,15 +477,10 @@ class AsmRostersCsvFile(AsmCsvFile):
 		:return list of AsmModel objects
 		:rtype: list(AsmRoster)
 		"""
+		self.reset_snapshot()
 		for school in self.get_schools():
-			student_dns = {student.dn for student in self.get_students(school)}
-			for ucs_obj in sorted(
-					SchoolClass.get_all(self.lo, school.name) + WorkGroup.get_all(self.lo, school.name),
-					key=attrgetter('name')
-			):
-				for user_dn in sorted(ucs_obj.users):
-					if user_dn in student_dns:
-						yield AsmRoster.from_dn(ucs_obj.dn, user_dn)
+			for group, user_dn, person_id in self.snapshot.get_memberships('students', school.name):
+				yield AsmRoster.from_object(group, person_id)
 
 
 class AsmStaffCsvFile(AsmCsvFile):
@@ -308,6 +488,17 @@ class AsmStaffCsvFile(AsmCsvFile):
 
 	header = AsmStaff.header
 
+	def get_header(self):  # type: () -> Iterable[AnyStr]
+		"""
+		Get the header of the CSV file, with as many `location_id_N` columns
+		as the staff member with the most schools needs.
+
+		:return: CSV header as list of strings
+		:rtype: list(str)
+		"""
+		num_locations = min(self.snapshot.get_max_location_ids('staff'), 15)
+		return list(self.header) + ['location_id_{}'.format(num) for num in range(2, num_locations + 1)]
+
 	def find_and_create_objects(self):  # type: () -> Iterator[AsmStaff]
 		"""
 		Find LDAP objects and return created AsmModel objects.
@@ -315,16 +506,8 @@ class AsmStaffCsvFile(AsmCsvFile):
 		:return list of AsmModel objects
 		:rtype: list(AsmStaff)
 		"""
-		dns = set()
-		for school in self.get_schools():
-			for teacher in self.get_staff(school):
-				t_schools = [teacher.school] + sorted(s for s in teacher.schools if s != teacher.school)
-				if self.ou_whitelist:
-					t_schools = [s for s in t_schools if s in self.ou_whitelist]
-				dns.add((t_schools[0], teacher.name, teacher.dn))
-		dns = [dn for school, name, dn in sorted(dns)]  # sorted by 1. school, 2. username
-		for dn in dns:
-			yield AsmStaff.from_dn(dn, ou_whitelist=self.ou_whitelist)
+		self.reset_snapshot()
+		return self.create_user_objects('staff', AsmStaff)
 
 
 class AsmStudentsCsvFile(AsmCsvFile):
@@ -332,6 +515,17 @@ class AsmStudentsCsvFile(AsmCsvFile):
 
 	header = AsmStudent.header
 
+	def get_header(self):  # type: () -> Iterable[AnyStr]
+		"""
+		Get the header of the CSV file, with as many `location_id_N` columns
+		as the student with the most schools needs.
+
+		:return: CSV header as list of strings
+		:rtype: list(str)
+		"""
+		num_locations = min(self.snapshot.get_max_location_ids('students'), 15)
+		return list(self.header) + ['location_id_{}'.format(num) for num in range(2, num_locations + 1)]
+
 	def find_and_create_objects(self):  # type: () -> Iterator[AsmStudent]
 		"""
 		Find LDAP objects and return created AsmModel objects.
@@ -339,16 +533,8 @@ class AsmStudentsCsvFile(AsmCsvFile):
 		:return list of AsmModel objects
 		:rtype: list(AsmStudent)
 		"""
-		dns = set()
-		for school in self.get_schools():
-			for student in self.get_students(school):
-				s_schools = [student.school] + sorted(s for s in student.schools if s != student.school)
-				if self.ou_whitelist:
-					s_schools = [s for s in s_schools if s in self.ou_whitelist]
-				dns.add((s_schools[0], student.name, student.dn))
-		dns = [dn for school, name, dn in sorted(dns)]  # sorted by 1. school, 2. username
-		for dn in dns:
-			yield AsmStudent.from_dn(dn, ou_whitelist=self.ou_whitelist)
+		self.reset_snapshot()
+		return self.create_user_objects('students', AsmStudent)
 
 
 csv_file_generators = {
@@ -387,10 +573,58 @@ def create_csv_files(target_directory, ou_whitelist=None):
 		os.mkdir(target_directory, 0o600)
 
 	logger.info('Creating CSV files%s...', ' for OUs {}'.format(', '.join(ou_whitelist)) if ou_whitelist else '')
-	results = []
-	for filename, cls in csv_file_generators.items():
+	lo, po = get_ldap_connection()
+	snapshot = DirectorySnapshot(lo, ou_whitelist)
+
+	def _write_csv(filename, cls):  # type: (AnyStr, Type[AsmCsvFile]) -> AnyStr
 		path = os.path.join(target_directory, filename)
-		results.append(path)
-		cls(path, ou_whitelist).write_csv()
+		cls(path, ou_whitelist, snapshot).write_csv()
+		return path
+
+	try:
+		results = map_csv_file_generators(_write_csv, snapshot)
+	finally:
+		snapshot.close()
 	logger.info('Finished creating CSV files.')
 	return results
+
+
+def map_csv_file_generators(func, snapshot, workers=None):
+	# type: (Callable[[AnyStr, Type[AsmCsvFile]], Any], DirectorySnapshot, Optional[int]) -> List[Any]
+	"""
+	Call `func(filename, generator class)` for each of the CSV files.
+
+	With more than one worker, the calls run in parallel threads that share
+	`snapshot`, each thread with its own LDAP connection. The results are
+	returned in the order of the file names, regardless of the order the
+	calls finish.
+
+	:param func: function to call for each CSV file
+	:param DirectorySnapshot snapshot: LDAP data shared by all generators
+	:param int workers: number of threads, value of UCR variable
+		`asm/csv/workers` if unset
+	:return: list of return values of `func`, sorted by file name
+	:rtype: list
+	"""
+	items = sorted(csv_file_generators.items())
+	workers = min(workers or get_csv_workers(), len(items))
+	if workers <= 1:
+		return [func(filename, cls) for filename, cls in items]
+
+	connections = []  # type: List[LoType]
+
+	def _init_worker():  # type: () -> None
+		lo, po = get_new_ldap_connection()
+		connections.append(lo)
+		snapshot.use_connection(lo)
+
+	logger = logging.getLogger(__name__)
+	logger.info('Creating CSV files in %d threads...', workers)
+	pool = ThreadPool(workers, initializer=_init_worker)
+	try:
+		return pool.map(lambda item: func(*item), items, chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+		for lo in connections:
+			lo.unbind()
@@ -36,26 +36,154 @@ See https://support.apple.com/en-us/HT207029
 """
 
 from __future__ import absolute_import, unicode_literals
+import hashlib
 import os
 import logging
 import shutil
 import sys
 import tempfile
+import warnings
 import zipfile
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 from univention.admin import uexceptions
 
-from .csv_file import create_csv_files
+from .csv_file import create_csv_files, csv_file_generators, map_csv_file_generators
+from ..snapshot import DirectorySnapshot
+from ..utils import get_csv_workers, get_ldap_connection, get_zip_compression
 
 try:
-	from typing import AnyStr, Iterable, Optional
+	from typing import Any, AnyStr, Iterable, Iterator, List, Optional, Tuple, Type
+	from tempfile import SpooledTemporaryFile
+	from .csv_file import AsmCsvFile
 except ImportError:
 	pass
 
 
+def _compress_block(data, level):  # type: (bytes, int) -> bytes
+	# Each block is compressed independently and ends on a byte boundary
+	# (Z_SYNC_FLUSH), so the compressed blocks can simply be concatenated.
+	compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+	return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class _ZipEntryWriter(object):
+	"""
+	File object that compresses everything written to it into a new entry of
+	an open, seekable :py:class:`zipfile.ZipFile`, so the data does not have
+	to be written to a file first. The entry is added when the object is
+	closed.
+
+	Python 2.7 :py:class:`zipfile.ZipFile` cannot do this itself, this
+	follows what :py:meth:`zipfile.ZipFile.write()` does for files.
+
+	If a thread pool is passed, the data is split into blocks of
+	:py:attr:`block_size` bytes that are compressed in parallel (zlib releases
+	the GIL) and joined into one DEFLATE stream, like pigz does it.
+
+	All entries get the same timestamp and permissions, so the same data
+	always results in the same ZIP file. The SHA-256 hash of the
+	uncompressed data is available in :py:attr:`checksum`.
+	"""
+
+	buffer_size = 64 * 1024
+	block_size = 1024 * 1024
+	date_time = (1980, 1, 1, 0, 0, 0)  # earliest date a ZIP file can store
+
+	def __init__(self, zf, arcname, level=zlib.Z_DEFAULT_COMPRESSION, pool=None, max_pending=4):
+		# type: (zipfile.ZipFile, AnyStr, int, Optional[ThreadPool], int) -> None
+		"""
+		:param zipfile.ZipFile zf: ZIP file opened for writing
+		:param str arcname: name of the entry in the ZIP file
+		:param int level: zlib compression level
+		:param ThreadPool pool: thread pool to compress blocks in (optional)
+		:param int max_pending: maximum number of blocks waiting for
+			compression, when using `pool`
+		"""
+		self.zf = zf
+		self.level = level
+		self.pool = pool
+		self.max_pending = max_pending
+		self.zinfo = zipfile.ZipInfo(arcname, self.date_time)
+		self.zinfo.compress_type = zipfile.ZIP_DEFLATED
+		self.zinfo.external_attr = 0o600 << 16
+		self.zinfo.flag_bits = 0x00
+		self.zinfo.header_offset = zf.fp.tell()
+		self.zinfo.CRC = 0
+		self.zinfo.create_system = 3  # Unix, independent of the platform the ZIP file is created on
+		self.zinfo.file_size = self.zinfo.compress_size = 0
+		zf._writecheck(self.zinfo)
+		zf._didModify = True
+		zf.fp.write(self.zinfo.FileHeader(False))  # will be rewritten with sizes and CRC in close()
+		self._compressor = None if pool else zlib.compressobj(level, zlib.DEFLATED, -15)
+		self._pending = deque()
+		self.checksum = hashlib.sha256()
+		self._buffer = []
+		self._buffered = 0
+		self._closed = False
+
+	def __enter__(self):  # type: () -> _ZipEntryWriter
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):  # type: (Any, Any, Any) -> None
+		self.close()
+
+	def write(self, data):  # type: (bytes) -> None
+		self._buffer.append(data)
+		self._buffered += len(data)
+		if self._buffered >= (self.block_size if self.pool else self.buffer_size):
+			self._compress()
+
+	def _compress(self):  # type: () -> None
+		data = b''.join(self._buffer)
+		self._buffer = []
+		self._buffered = 0
+		if not data:
+			return
+		self.zinfo.file_size += len(data)
+		self.zinfo.CRC = zlib.crc32(data, self.zinfo.CRC) & 0xffffffff
+		self.checksum.update(data)
+		if self.pool:
+			self._pending.append(self.pool.apply_async(_compress_block, (data, self.level)))
+			while len(self._pending) > self.max_pending:
+				self._write_compressed(self._pending.popleft().get())
+		else:
+			self._write_compressed(self._compressor.compress(data))
+
+	def _write_compressed(self, compressed):  # type: (bytes) -> None
+		self.zinfo.compress_size += len(compressed)
+		self.zf.fp.write(compressed)
+
+	def close(self):  # type: () -> None
+		if self._closed:
+			return
+		self._closed = True
+		self._compress()
+		if self.pool:
+			while self._pending:
+				self._write_compressed(self._pending.popleft().get())
+			# an empty final block terminates the stream of sync flushed blocks
+			self._write_compressed(zlib.compressobj(self.level, zlib.DEFLATED, -15).flush())
+		else:
+			self._write_compressed(self._compressor.flush())
+		if max(self.zinfo.file_size, self.zinfo.compress_size) > zipfile.ZIP64_LIMIT:
+			raise zipfile.LargeZipFile('Entry {!r} is too large.'.format(self.zinfo.filename))
+		position = self.zf.fp.tell()
+		self.zf.fp.seek(self.zinfo.header_offset, 0)
+		self.zf.fp.write(self.zinfo.FileHeader(False))
+		self.zf.fp.seek(position, 0)
+		self.zf.filelist.append(self.zinfo)
+		self.zf.NameToInfo[self.zinfo.filename] = self.zinfo
+
+
 class AsmZipFile(object):
 	"""Class to create a ZIP file with ASM CSV files."""
 
+	spool_max_size = 64 * 1024 * 1024  # CSV data created in parallel is kept in memory up to this size
+
 	def __init__(self, file_path, ou_whitelist=None):  # type: (AnyStr, Optional[Iterable[AnyStr]]) -> None
 		"""
 		:param str file_path: file path to write ZIP to
@@ -66,6 +194,10 @@ class AsmZipFile(object):
 		self.ou_whitelist = ou_whitelist
 		self.csv_files = []
 		self.logger = logging.getLogger(__name__)
+		self.compression_level, self.compression_threads = get_zip_compression()
+		self._compression_pool = None  # type: ThreadPool
+		self._entries = []  # type: List[_ZipEntryWriter]
+		self.content_hash = None  # type: Optional[str]
 
 	def create_csv_files(self, tmp_dir):  # type: (str) -> Iterable[AnyStr]
 		"""
@@ -82,39 +214,113 @@ class AsmZipFile(object):
 		self.logger.debug('Created CSV files: %s.', ', '.join(sorted(self.csv_files)))
 		return self.csv_files
 
-	def write_zip(self, file_path=None, delete_csv_files=True):  # type: (Optional[AnyStr], Optional[bool]) -> AnyStr
+	def write_zip(self, file_path=None, delete_csv_files=None):  # type: (Optional[AnyStr], Optional[bool]) -> AnyStr
 		"""
 		Compress CSV files into a ZIP file. An existing file will be overwritten.
 
+		The hash of the CSV data will be saved to :py:attr:`self.content_hash`.
+
 		If :py:attr:`self.csv_files` is non-empty, those files will be used,
-		else they will be created.
+		else the CSV data will be written directly into the ZIP file, without
+		creating CSV files.
 
 		:param str file_path: path to write ZIP to, if unset will be written to :py:attr:`self.file_path`
-		:param bool delete_csv_files: whether the CSV files should be removed afterwards
+		:param bool delete_csv_files: deprecated and ignored, no temporary CSV
+			files are created anymore
 		:return: path to the created ZIP file
 		:rtype: str
 		"""
+		if delete_csv_files is not None:
+			warnings.warn(
+				'The delete_csv_files argument of write_zip() is ignored, no temporary CSV files are created anymore.',
+				DeprecationWarning, stacklevel=2
+			)
 		file_path = file_path or self.file_path
-		tmp_dir = tempfile.mkdtemp()
 		assert file_path, 'ZIP file path is empty.'
 		self.logger.info('Creating ZIP file in %s...', file_path)
-		if self.csv_files:
-			self.logger.debug('Using existing CSV files: %s.', ', '.join(sorted(self.csv_files)))
-		else:
+		if not self.csv_files:
 			try:
-				self.csv_files = self.create_csv_files(tmp_dir)
+				self.write_csv_files_to_zip(file_path)
 			except uexceptions.valueInvalidSyntax:
-				shutil.rmtree(tmp_dir, ignore_errors=True)
+				os.remove(file_path)
 				self.logger.error("Error during creation of csv files. Abort asm-upload.")
 				sys.exit(1)
+			self.logger.info('Finished creating ZIP file.')
+			return file_path
+		self.logger.debug('Using existing CSV files: %s.', ', '.join(sorted(self.csv_files)))
 		self.logger.debug('Writing ZIP file to %s...', file_path)
-		with open(file_path,  'wb') as fp, zipfile.ZipFile(fp, 'w', zipfile.ZIP_DEFLATED) as zf:
-			os.fchmod(fp.fileno(), 0o600)
+		with self._open_zip(file_path) as zf:
 			for path in sorted(self.csv_files):
-				zf.write(path, os.path.basename(path))
+				with open(path, 'rb') as csv_fp, self._open_entry(zf, os.path.basename(path)) as entry:
+					shutil.copyfileobj(csv_fp, entry, _ZipEntryWriter.buffer_size)
 		self.logger.debug('Done writing ZIP file.')
-		if delete_csv_files:
-			self.logger.debug('Deleting temporary CSV files and directory...')
-			shutil.rmtree(tmp_dir, ignore_errors=True)
 		self.logger.info('Finished creating ZIP file.')
 		return file_path
+
+	def write_csv_files_to_zip(self, file_path):  # type: (AnyStr) -> None
+		"""
+		Create the ASM CSV data and write it directly into a new ZIP file. An
+		existing file will be overwritten.
+
+		:param str file_path: path to write ZIP to
+		:return: None
+		"""
+		self.logger.debug('Writing CSV data to ZIP file %s...', file_path)
+		lo, po = get_ldap_connection()
+		snapshot = DirectorySnapshot(lo, self.ou_whitelist)
+		workers = get_csv_workers()
+		try:
+			with self._open_zip(file_path) as zf:
+				if workers <= 1:
+					for filename, cls in sorted(csv_file_generators.items()):
+						with self._open_entry(zf, filename) as entry:
+							cls(filename, self.ou_whitelist, snapshot).write_csv(fp=entry)
+				else:
+					# generators run in parallel, ZIP entries must be written one after the other
+					def _write_csv(filename, cls):  # type: (AnyStr, Type[AsmCsvFile]) -> Tuple[AnyStr, SpooledTemporaryFile]
+						spool = tempfile.SpooledTemporaryFile(max_size=self.spool_max_size, mode='w+b')
+						cls(filename, self.ou_whitelist, snapshot).write_csv(fp=spool)
+						spool.seek(0)
+						return filename, spool
+
+					for filename, spool in map_csv_file_generators(_write_csv, snapshot, workers):
+						with spool, self._open_entry(zf, filename) as entry:
+							shutil.copyfileobj(spool, entry, _ZipEntryWriter.buffer_size)
+		finally:
+			snapshot.close()
+		self.logger.debug('Done writing ZIP file.')
+
+	@contextmanager
+	def _open_zip(self, file_path):  # type: (AnyStr) -> Iterator[zipfile.ZipFile]
+		self._entries = []
+		self.content_hash = None
+		if self.compression_threads > 1:
+			self._compression_pool = ThreadPool(self.compression_threads)
+		try:
+			with open(file_path, 'wb') as fp, zipfile.ZipFile(fp, 'w', zipfile.ZIP_DEFLATED) as zf:
+				os.fchmod(fp.fileno(), 0o600)
+				yield zf
+			self.content_hash = self._get_content_hash()
+		finally:
+			if self._compression_pool:
+				self._compression_pool.close()
+				self._compression_pool.join()
+				self._compression_pool = None
+
+	def _open_entry(self, zf, arcname):  # type: (zipfile.ZipFile, AnyStr) -> _ZipEntryWriter
+		entry = _ZipEntryWriter(
+			zf, arcname, self.compression_level, self._compression_pool, 2 * self.compression_threads
+		)
+		self._entries.append(entry)
+		return entry
+
+	def _get_content_hash(self):  # type: () -> str
+		"""
+		SHA-256 hash over the names and contents of all entries. Unlike a
+		hash of the ZIP file itself, it does not depend on the compression
+		settings.
+		"""
+		content_hash = hashlib.sha256()
+		for entry in sorted(self._entries, key=lambda e: e.zinfo.filename):
+			content_hash.update('{}\0{}\n'.format(entry.zinfo.filename, entry.checksum.hexdigest()).encode('utf-8'))
+		return content_hash.hexdigest()
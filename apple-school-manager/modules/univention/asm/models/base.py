@@ -35,36 +35,83 @@ Base class for all ASM models.
 
 from __future__ import absolute_import, unicode_literals
 import inspect
-from ..utils import get_ucr
+from operator import attrgetter
+from ..plan import ExportPlan
+from ..utils import get_anonymize_mapping
 from ucsschool.lib.models.user import User
 
 try:
-	from typing import Any, AnyStr, Dict, Iterable, Union
+	from typing import Any, AnyStr, Callable, Dict, Iterable, List, Optional, Union
 except ImportError:
 	pass
 
 
+_interned = {}  # type: Dict[AnyStr, AnyStr]
+
+
+def intern_string(value):  # type: (Optional[AnyStr]) -> Optional[AnyStr]
+	"""
+	Get a shared copy of a string that is stored in many objects (like
+	school names), so it is kept in memory only once. Works for unicode
+	strings, unlike the builtin :py:func:`intern()` in Python 2.
+
+	Interned strings are never released, so this must only be used for
+	values with few distinct values (location IDs, grade levels, password
+	policies), not for IDs of users or classes.
+
+	:param str value: string (or None)
+	:return: equal string, the same object for all equal strings
+	:rtype: str
+	"""
+	if value is None:
+		return value
+	return _interned.setdefault(value, value)
+
+
 class AsmModel(object):
-	"""Base class for all ASM models."""
+	"""
+	Base class for all ASM models.
 
+	Subclasses store their values in :py:attr:`__slots__`. Models with a
+	variable number of columns (like `location_id_2` ... `location_id_15`)
+	store the values of those columns as one tuple in the attribute named by
+	:py:attr:`variable_columns_attr`. The columns can still be read as
+	attributes (e.g. `obj.location_id_2`).
+	"""
+
+	__slots__ = ()
 	header = ()  # type: Iterable[AnyStr]
+	variable_columns_attr = ''  # name of the attribute with the values of the variable columns
+	variable_columns_name = ''  # format string for the names of the variable columns
+	variable_columns_start = 2  # number of the first variable column
 
 	def __init__(self, *args, **kwargs):  # type: (*Any, **Any) -> None
 		pass
 
 	def __repr__(self):  # type: () -> AnyStr
-		if not self.header:
+		header = self.get_header()
+		if not header:
 			members = [
 				m for m in inspect.getmembers(self, predicate=lambda x: not inspect.ismethod(x))
 				if not m[0].startswith('_') and m[0] != 'header'
 			]
 		else:
-			members = zip(self.header, [getattr(self, m) for m in self.header])
+			members = zip(header, [getattr(self, m) for m in header])
 		return '{}({})'.format(
 			self.__class__.__name__,
 			', '.join('{}={!r}'.format(k, v) for k, v in members)
 		)
 
+	def __getattr__(self, name):  # type: (str) -> Any
+		# only called if there is no regular attribute `name`
+		prefix = self.variable_columns_name.split('{', 1)[0]
+		if prefix and name.startswith(prefix) and name[len(prefix):].isdigit():
+			index = int(name[len(prefix):]) - self.variable_columns_start
+			values = getattr(self, self.variable_columns_attr)
+			if 0 <= index < len(values):
+				return values[index]
+		raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, name))
+
 	def get_header(self):  # type: () -> Iterable[AnyStr]
 		"""
 		Get the header for a CSV representation of the object.
@@ -72,8 +119,24 @@ class AsmModel(object):
 		:return: CSV header as list of strings
 		:rtype: list(str)
 		"""
+		if self.variable_columns_attr:
+			num = len(getattr(self, self.variable_columns_attr))
+			if num:
+				return list(self.header) + self.get_variable_column_names(num)
 		return self.header
 
+	@classmethod
+	def get_variable_column_names(cls, num):  # type: (int) -> List[AnyStr]
+		"""
+		Get the names of the first `num` variable columns.
+
+		:param int num: number of columns
+		:return: list of column names
+		:rtype: list(str)
+		"""
+		start = cls.variable_columns_start
+		return [cls.variable_columns_name.format(n) for n in range(start, start + num)]
+
 	@classmethod
 	def from_dn(cls, dn, *args, **kwargs):  # type: (AnyStr, *Any, **Any) -> AsmModel
 		"""
@@ -85,6 +148,17 @@ class AsmModel(object):
 		"""
 		raise NotImplementedError()
 
+	@classmethod
+	def from_object(cls, obj, *args, **kwargs):  # type: (Any, *Any, **Any) -> AsmModel
+		"""
+		Get AsmModel object created from an already loaded object.
+
+		:param obj: object to represent
+		:return: AsmModel instance
+		:rtype: AsmModel
+		"""
+		raise NotImplementedError()
+
 	def as_csv_line(self):  # type: () -> Iterable[AnyStr]
 		"""
 		Get this object represented as a list of strings.
@@ -121,13 +195,53 @@ class AsmModel(object):
 					self.__class__.__name__)
 			)
 
+	@classmethod
+	def get_row_extractor(cls, header):  # type: (Iterable[AnyStr]) -> Callable[[AsmModel], List[Any]]
+		"""
+		Get a function that returns the values of an object of this class
+		for the columns in `header`, like :py:meth:`as_dict()` but as a list
+		in the order of `header`. Columns the object does not have (e.g.
+		`location_id_3` for a user with two schools) are empty.
+
+		The columns of :py:attr:`header` of the class and the tuple with the
+		variable columns are read with one :py:func:`operator.attrgetter`
+		call.
+
+		:param header: CSV header, must start with :py:attr:`header` of the class
+		:type header: list(str)
+		:return: function that takes an object and returns a list
+		:rtype: callable
+		"""
+		header = tuple(header)
+		fixed = tuple(cls.header)
+		if len(fixed) < 2 or header[:len(fixed)] != fixed:
+			return lambda obj: [getattr(obj, member, None) or '' for member in header]
+		get_fixed = attrgetter(*fixed)
+		extra = header[len(fixed):]
+		if not extra:
+			return lambda obj: [value or '' for value in get_fixed(obj)]
+		if not cls.variable_columns_attr or extra != tuple(cls.get_variable_column_names(len(extra))):
+			return lambda obj: [value or '' for value in get_fixed(obj)] + [
+				getattr(obj, member, None) or '' for member in extra
+			]
+		get_values = attrgetter(*(fixed + (cls.variable_columns_attr,)))
+		num_columns = len(header)
+
+		def extract(obj):  # type: (AsmModel) -> List[Any]
+			values = get_values(obj)
+			row = [value or '' for value in values[:-1] + tuple(values[-1])]
+			row.extend([''] * (num_columns - len(row)))
+			return row
+		return extract
+
 
 class AnonymizeMixIn(object):
+	__slots__ = ()
 	ucr_anonymize_key_base = ''
 
 	@classmethod
-	def anonymize(cls, user, ldap_attrs, **kwargs):
-		# type: (User, Dict[AnyStr, Any], **Any) -> Dict[AnyStr, AnyStr]
+	def anonymize(cls, user, ldap_attrs, plan=None, **kwargs):
+		# type: (User, Dict[AnyStr, Any], Optional[ExportPlan], **Any) -> Dict[AnyStr, AnyStr]
 		"""
 		Change values of function arguments to anonymize/pseudonymize user if
 		UCRV asm/attributes/<staff/student>/anonymize is true. Will return
@@ -135,35 +249,19 @@ class AnonymizeMixIn(object):
 
 		:param User user: user object
 		:param dict ldap_attrs: dictionary with the users LDAP attributes
+		:param ExportPlan plan: UCR settings of the current run, read from UCR if unset
 		:return: dictionary with [modified] function arguments
 		:rtype: dict
 		:raises NotImplementedError: if cls.ucr_anonymize_key_base is unset
 		"""
-		ucr = get_ucr()
-		if ucr.is_true(cls.ucr_anonymize_key_base):
-			for k, v in cls.anonymize_mapping().items():
-				if v and v.startswith('%'):
-					attr = v[1:].strip()
-					try:
-						v = ldap_attrs[attr][0]
-					except KeyError:
-						raise ValueError('Attribute {!r} not found in LDAP object of {}.'.format(attr, user))
-					except IndexError:
-						raise ValueError('Attribute {!r} empty in LDAP object of {}.'.format(attr, user))
-				kwargs[k] = v
-		return kwargs
+		if not cls.ucr_anonymize_key_base:
+			raise NotImplementedError('Class attribute "ucr_anonymize_key_base" must be set.')
+		plan = plan or ExportPlan()
+		return plan.anonymize(cls.ucr_anonymize_key_base, user, ldap_attrs, kwargs)
 
 	@classmethod
 	def anonymize_mapping(cls):  # type: () -> Dict[AnyStr, Union[AnyStr, None]]
 		if not cls.ucr_anonymize_key_base:
 			raise NotImplementedError('Class attribute "ucr_anonymize_key_base" must be set.')
 		cls.ucr_anonymize_key_base = cls.ucr_anonymize_key_base.rstrip('/')
-		ucr = get_ucr()
-		res = {
-			'first_name': ucr.get('{}/first_name'.format(cls.ucr_anonymize_key_base), '%uid'),
-			'middle_name': ucr.get('{}/middle_name'.format(cls.ucr_anonymize_key_base), None),
-			'last_name': ucr.get('{}/last_name'.format(cls.ucr_anonymize_key_base), 'No Name'),
-			'email_address': ucr.get('{}/email_address'.format(cls.ucr_anonymize_key_base), None),
-			'sis_username': ucr.get('{}/sis_username'.format(cls.ucr_anonymize_key_base), '%uid'),
-		}
-		return res
+		return get_anonymize_mapping(cls.ucr_anonymize_key_base)
@@ -38,16 +38,14 @@ See https://support.apple.com/en-us/HT207029
 from __future__ import absolute_import, unicode_literals
 import logging
 
-from ucsschool.lib.models.group import SchoolClass, WorkGroup
-from ucsschool.lib.models.base import UnknownModel
-
-
-from ..utils import get_ldap_connection, get_person_id, get_ucr
-from .base import AsmModel
-from .staff import get_filtered_staff
+from ..snapshot import DirectorySnapshot
+from ..utils import get_ldap_connection
+from .base import AsmModel, intern_string
 
 try:
-	from typing import Any, AnyStr, Iterable, Optional, Dict, List
+	from typing import Any, AnyStr, Iterable, Optional, Dict, List, Union
+	from ucsschool.lib.models.group import SchoolClass, WorkGroup
+	from ..snapshot import SchoolGroup
 except ImportError:
 	pass
 
@@ -59,7 +57,10 @@ class AsmClass(AsmModel):
 		'class_id', 'class_number', 'course_id', 'instructor_id', 'instructor_id_2', 'instructor_id_3',
 		'location_id'
 	)
-	_class_number_empty = None
+	__slots__ = header + ('additional_instructor_ids',)
+	variable_columns_attr = 'additional_instructor_ids'
+	variable_columns_name = 'instructor_id_{}'
+	variable_columns_start = 4
 
 	def __init__(
 			self,
@@ -97,57 +98,57 @@ class AsmClass(AsmModel):
 		if additional_instructor_ids:
 			assert len(additional_instructor_ids) < 13, 'No more than 12 additional instructors are allowed.'
 		else:
-			additional_instructor_ids = []
+			additional_instructor_ids = ()
 		super(AsmClass, self).__init__(
 			class_id, course_id, location_id, class_number, instructor_id, instructor_id_2,
 			instructor_id_3, additional_instructor_ids
 		)
 		self.class_id = class_id
 		self.course_id = course_id
-		self.location_id = location_id
+		self.location_id = intern_string(location_id)
 		self.class_number = class_number
 		self.instructor_id = instructor_id
 		self.instructor_id_2 = instructor_id_2
 		self.instructor_id_3 = instructor_id_3
-		self.additional_instructor_ids = additional_instructor_ids
-		if additional_instructor_ids:
-			# add members, so that default as_csv_line() will work
-			instructor_id_attrs = ['instructor_id_{}'.format(num) for num in range(4, 4 + len(additional_instructor_ids))]
-			for instr_id_attr, instr_id in zip(instructor_id_attrs, additional_instructor_ids):
-				setattr(self, instr_id_attr, instr_id)
-			# update header
-			self.header = list(self.header) + [
-				'instructor_id_{}'.format(num) for num in range(4, 4 + len(additional_instructor_ids))
-			]
+		self.additional_instructor_ids = tuple(additional_instructor_ids)
 
 	@classmethod
-	def from_dn(cls, dn, *args, **kwargs):  # type: (AnyStr, *Any, **Any) -> AsmClass
+	def from_dn(cls, dn, snapshot=None, *args, **kwargs):
+		# type: (AnyStr, Optional[DirectorySnapshot], *Any, **Any) -> AsmClass
 		"""
 		Get AsmClass object created from data in LDAP object.
 
 		:param str dn: DN to the SchoolClass/Workgroup object to represent
+		:param DirectorySnapshot snapshot: LDAP data of the current run (optional)
 		:return: AsmClass instance
 		:rtype: AsmClass
 		"""
 		lo, po = get_ldap_connection()
-		ucr = get_ucr()
+		snapshot = snapshot or DirectorySnapshot(lo)
+		return cls.from_object(snapshot.get_group(dn), snapshot)
+
+	@classmethod
+	def from_object(cls, school_class, snapshot=None, *args, **kwargs):
+		# type: (Union[SchoolGroup, SchoolClass, WorkGroup], Optional[DirectorySnapshot], *Any, **Any) -> AsmClass
+		"""
+		Get AsmClass object created from a loaded school class or work group.
+
+		:param school_class: SchoolGroup, SchoolClass or WorkGroup object to represent
+		:param DirectorySnapshot snapshot: LDAP data of the current run (optional)
+		:return: AsmClass instance
+		:rtype: AsmClass
+		"""
 		logger = logging.getLogger(__name__)
-		try:
-			school_class = SchoolClass.from_dn(dn, None, lo)
-		except UnknownModel:
-			school_class = WorkGroup.from_dn(dn, None, lo)
-		if cls._class_number_empty is None:
-			cls._class_number_empty = ucr.is_true('asm/attributes/classes/class_number_empty', True)
+		if not snapshot:
+			lo, po = get_ldap_connection()
+			snapshot = DirectorySnapshot(lo)
 		teachers = []
-		expected_teachers = get_filtered_staff(lo, logger, school_class.school)
-		expected_teachers_dns = [teacher.dn for teacher in expected_teachers]
-
+		expected_teachers = snapshot.get_school_person_ids('staff', school_class.school)
 		for user_dn in school_class.users:
-			if user_dn not in expected_teachers_dns:
+			try:
+				teachers.append(expected_teachers[user_dn])
+			except KeyError:
 				logger.debug("User {} is excluded due to a ldap-filter set in UCR-V asm/ldap_filter/staff".format(user_dn))
-				continue
-			person_id_attr, teacher_lo = get_person_id(user_dn, 'staff', [])
-			teachers.append(teacher_lo[person_id_attr][0])
 		instructor_id = instructor_id_2 = instructor_id_3 = additional_instructor_ids = None
 		if teachers:
 			try:
@@ -165,7 +166,7 @@ class AsmClass(AsmModel):
 			class_id=school_class.name,
 			course_id=school_class.name,
 			location_id=school_class.school,
-			class_number='' if cls._class_number_empty else school_class.name,
+			class_number='' if snapshot.plan.class_number_empty else school_class.name,
 			instructor_id=instructor_id,
 			instructor_id_2=instructor_id_2,
 			instructor_id_3=instructor_id_3,
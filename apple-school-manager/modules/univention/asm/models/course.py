@@ -38,13 +38,15 @@ See https://support.apple.com/en-us/HT207029
 from __future__ import absolute_import, unicode_literals
 import logging
 
-from .base import AsmModel
-from ..utils import get_ldap_connection, get_ucr
-from ucsschool.lib.models.group import SchoolClass, WorkGroup
-from ucsschool.lib.models.base import UnknownModel
+from .base import AsmModel, intern_string
+from ..snapshot import DirectorySnapshot
+from ..plan import ExportPlan
+from ..utils import get_ldap_connection
 
 try:
-	from typing import Any, AnyStr, Optional
+	from typing import Any, AnyStr, Optional, Union
+	from ucsschool.lib.models.group import SchoolClass, WorkGroup
+	from ..snapshot import SchoolGroup
 except ImportError:
 	pass
 
@@ -53,6 +55,7 @@ class AsmCourse(AsmModel):
 	"""Class to represent an ASM course entry."""
 
 	header = ('course_id', 'course_number', 'course_name', 'location_id')
+	__slots__ = header
 
 	def __init__(
 			self,
@@ -77,33 +80,44 @@ class AsmCourse(AsmModel):
 		"""
 		super(AsmCourse, self).__init__(course_id, location_id, course_number, course_name)
 		self.course_id = course_id
-		self.location_id = location_id
+		self.location_id = intern_string(location_id)
 		self.course_number = course_number
 		self.course_name = course_name
 
 	@classmethod
-	def from_dn(cls, dn, *args, **kwargs):  # type: (AnyStr, *Any, **Any) -> AsmCourse
+	def from_dn(cls, dn, snapshot=None, *args, **kwargs):
+		# type: (AnyStr, Optional[DirectorySnapshot], *Any, **Any) -> AsmCourse
 		"""
 		Get AsmCourse object created from data in LDAP object.
 
 		:param str dn: DN to the SchoolClass/Workgroup object to represent
+		:param DirectorySnapshot snapshot: LDAP data of the current run (optional)
 		:return: AsmCourse instance
 		:rtype: AsmCourse
 		"""
 		lo, po = get_ldap_connection()
-		try:
-			school_class = SchoolClass.from_dn(dn, None, lo)
-		except UnknownModel:
-			school_class = WorkGroup.from_dn(dn, None, lo)
+		snapshot = snapshot or DirectorySnapshot(lo)
+		return cls.from_object(snapshot.get_group(dn), snapshot)
+
+	@classmethod
+	def from_object(cls, school_class, snapshot=None, *args, **kwargs):
+		# type: (Union[SchoolGroup, SchoolClass, WorkGroup], Optional[DirectorySnapshot], *Any, **Any) -> AsmCourse
+		"""
+		Get AsmCourse object created from a loaded school class or work group.
 
-		course_pattern = get_ucr().get("asm/attributes/course-name-pattern", "{ou}-{name}")
+		:param school_class: SchoolGroup, SchoolClass or WorkGroup object to represent
+		:param DirectorySnapshot snapshot: LDAP data of the current run (optional)
+		:return: AsmCourse instance
+		:rtype: AsmCourse
+		"""
+		plan = snapshot.plan if snapshot else ExportPlan()
 		try:
 			name = school_class.name.split("-", 1)[1]
 		except IndexError:
 			logger = logging.getLogger(__name__)
-			logger.warning("{}: course {!r} is missing an OU".format(dn, school_class.name))
+			logger.warning("{}: course {!r} is missing an OU".format(school_class.dn, school_class.name))
 			name = school_class.name
-		course_name = course_pattern.replace("{ou}", school_class.school).replace("{name}", name)
+		course_name = plan.get_course_name(school_class.school, name)
 		return cls(
 			course_id=school_class.name,
 			location_id=school_class.school,
@@ -37,11 +37,12 @@ See https://support.apple.com/en-us/HT207029
 
 from __future__ import absolute_import, unicode_literals
 from .base import AsmModel
+from ..snapshot import DirectorySnapshot
 from ..utils import get_ldap_connection
-from ucsschool.lib.models.school import School
 
 try:
-	from typing import Any, AnyStr
+	from typing import Any, AnyStr, Optional
+	from ucsschool.lib.models.school import School
 except ImportError:
 	pass
 
@@ -50,6 +51,7 @@ class AsmLocation(AsmModel):
 	"""Class to represent an ASM location entry."""
 
 	header = ('location_id', 'location_name')
+	__slots__ = header
 
 	def __init__(self, location_id, location_name):  # type: (AnyStr, AnyStr) -> None
 		"""
@@ -62,14 +64,27 @@ class AsmLocation(AsmModel):
 		self.location_name = location_name
 
 	@classmethod
-	def from_dn(cls, dn, *args, **kwargs):  # type: (AnyStr, *Any, **Any) -> AsmLocation
+	def from_dn(cls, dn, snapshot=None, *args, **kwargs):
+		# type: (AnyStr, Optional[DirectorySnapshot], *Any, **Any) -> AsmLocation
 		"""
 		Get AsmLocation object created from data in LDAP object.
 
 		:param str dn: DN to the School/OU object to represent
+		:param DirectorySnapshot snapshot: LDAP data of the current run (optional)
 		:return: AsmLocation instance
 		:rtype: AsmLocation
 		"""
 		lo, po = get_ldap_connection()
-		school = School.from_dn(dn, None, lo)
+		snapshot = snapshot or DirectorySnapshot(lo)
+		return cls.from_object(snapshot.get_school(dn))
+
+	@classmethod
+	def from_object(cls, school, *args, **kwargs):  # type: (School, *Any, **Any) -> AsmLocation
+		"""
+		Get AsmLocation object created from a loaded School object.
+
+		:param School school: School object to represent
+		:return: AsmLocation instance
+		:rtype: AsmLocation
+		"""
 		return cls(school.name, school.display_name or school.name)
@@ -37,13 +37,13 @@ See https://support.apple.com/en-us/HT207029
 
 from __future__ import absolute_import, unicode_literals
 from .base import AsmModel
-from ..utils import get_person_id, get_ldap_connection
-from ucsschool.lib.models.base import UnknownModel
-from ucsschool.lib.models.group import SchoolClass, WorkGroup
-from ucsschool.lib.models.user import Student
+from ..snapshot import DirectorySnapshot
+from ..utils import get_ldap_connection
 
 try:
-	from typing import Any, AnyStr
+	from typing import Any, AnyStr, Optional, Union
+	from ucsschool.lib.models.group import SchoolClass, WorkGroup
+	from ..snapshot import SchoolGroup
 except ImportError:
 	pass
 
@@ -52,6 +52,7 @@ class AsmRoster(AsmModel):
 	"""Class to represent an ASM roster entry."""
 
 	header = ('roster_id', 'class_id', 'student_id')
+	__slots__ = header
 
 	def __init__(
 			self,
@@ -73,23 +74,36 @@ class AsmRoster(AsmModel):
 		self.student_id = student_id
 
 	@classmethod
-	def from_dn(cls, class_dn, student_dn, *args, **kwargs):  # type: (AnyStr, AnyStr, *Any, **Any) -> AsmRoster
+	def from_dn(cls, class_dn, student_dn, snapshot=None, *args, **kwargs):
+		# type: (AnyStr, AnyStr, Optional[DirectorySnapshot], *Any, **Any) -> AsmRoster
 		"""
 		Get AsmRoster object created from data in LDAP object.
 
 		:param str class_dn: DN to the SchoolClass/Workgroup object to represent
 		:param str student_dn: DN to the student object to represent
+		:param DirectorySnapshot snapshot: LDAP data of the current run (optional)
 		:return: AsmRoster instance
 		:rtype: AsmRoster
 		"""
 		lo, po = get_ldap_connection()
-		try:
-			school_class = SchoolClass.from_dn(class_dn, None, lo)
-		except UnknownModel:
-			school_class = WorkGroup.from_dn(class_dn, None, lo)
-		student = Student.from_dn(student_dn, None, lo)
-		person_id_attr, student_lo = get_person_id(student.dn, 'student', [])
-		person_id = student_lo[person_id_attr][0]
+		snapshot = snapshot or DirectorySnapshot(lo)
+		school_class = snapshot.get_group(class_dn)
+		if not snapshot.has_user(student_dn, 'students'):
+			snapshot.get_user(student_dn, 'students')  # raises WrongModel if not a student
+		return cls.from_object(school_class, snapshot.get_person_id(student_dn, 'students'))
+
+	@classmethod
+	def from_object(cls, school_class, person_id, *args, **kwargs):
+		# type: (Union[SchoolGroup, SchoolClass, WorkGroup], AnyStr, *Any, **Any) -> AsmRoster
+		"""
+		Get AsmRoster object created from a loaded school class or work group
+		and the person_id of a student.
+
+		:param school_class: SchoolGroup, SchoolClass or WorkGroup object to represent
+		:param str person_id: person_id of the student
+		:return: AsmRoster instance
+		:rtype: AsmRoster
+		"""
 		return cls(
 			roster_id='{}-{}'.format(school_class.name, person_id),
 			class_id=school_class.name,
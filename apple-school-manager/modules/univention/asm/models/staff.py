@@ -40,14 +40,15 @@ import logging
 from backports.functools_lru_cache import lru_cache
 
 from ucsschool.lib.models.user import Teacher, TeachersAndStaff
-from ucsschool.lib.models.base import WrongModel
 from univention.admin import uexceptions
 
-from ..utils import check_domain, get_ldap_connection, get_person_id, get_ucr, prepend_to_mail_domain
-from .base import AnonymizeMixIn, AsmModel
+from ..snapshot import DirectorySnapshot
+from ..utils import get_ldap_connection, get_ucr
+from .base import AnonymizeMixIn, AsmModel, intern_string
 
 try:
-	from typing import Any, AnyStr, Iterable, Optional
+	from typing import Any, AnyStr, Iterable, Optional, Union
+	from ..snapshot import SchoolUser
 	from ucsschool.importer.utils.ldap_connection import LoType
 except ImportError:
 	pass
@@ -60,7 +61,10 @@ class AsmStaff(AsmModel, AnonymizeMixIn):
 		'person_id', 'person_number', 'first_name', 'middle_name', 'last_name', 'email_address', 'sis_username',
 		'location_id'
 	)
+	__slots__ = header + ('additional_location_ids',)
 	ucr_anonymize_key_base = 'asm/attributes/staff/anonymize'
+	variable_columns_attr = 'additional_location_ids'
+	variable_columns_name = 'location_id_{}'
 
 	def __init__(
 			self,
@@ -101,7 +105,7 @@ class AsmStaff(AsmModel, AnonymizeMixIn):
 		if additional_location_ids:
 			assert len(additional_location_ids) < 15, 'No more than 14 additional locations are allowed.'
 		else:
-			additional_location_ids = []
+			additional_location_ids = ()
 		super(AsmStaff, self).__init__(
 			person_id, first_name, last_name, location_id, person_number, middle_name, email_address, sis_username,
 			additional_location_ids
@@ -109,25 +113,16 @@ class AsmStaff(AsmModel, AnonymizeMixIn):
 		self.person_id = person_id
 		self.first_name = first_name
 		self.last_name = last_name
-		self.location_id = location_id
+		self.location_id = intern_string(location_id)
 		self.person_number = person_number
 		self.middle_name = middle_name
 		self.email_address = email_address
 		self.sis_username = sis_username
-		self.additional_location_ids = additional_location_ids
-		if additional_location_ids:
-			# add members, so that default as_csv_line() will work
-			location_id_attrs = ['location_id_{}'.format(num) for num in range(2, 2 + len(additional_location_ids))]
-			for loc_id_attr, loc_id in zip(location_id_attrs, additional_location_ids):
-				setattr(self, loc_id_attr, loc_id)
-			# update header
-			self.header = list(self.header) + [
-				'location_id_{}'.format(num) for num in range(2, 2 + len(additional_location_ids))
-			]
+		self.additional_location_ids = tuple(intern_string(loc_id) for loc_id in additional_location_ids)
 
 	@classmethod
-	def from_dn(cls, dn, ou_whitelist=None, *args, **kwargs):
-		# type: (AnyStr, Optional[Iterable[AnyStr]], *Any, **Any) -> AsmStaff
+	def from_dn(cls, dn, ou_whitelist=None, snapshot=None, *args, **kwargs):
+		# type: (AnyStr, Optional[Iterable[AnyStr]], Optional[DirectorySnapshot], *Any, **Any) -> AsmStaff
 		"""
 		Get AsmStaff object created from data in LDAP object.
 
@@ -135,6 +130,7 @@ class AsmStaff(AsmModel, AnonymizeMixIn):
 		:param ou_whitelist: list of schools/OUs that should be considered when
 			looking at ou-overlapping users. No limit if empty or None.
 		:type ou_whitelist: list(str) or None
+		:param DirectorySnapshot snapshot: LDAP data of the current run (optional)
 		:return: AsmStaff instance
 		:rtype: AsmStaff
 		:raises WrongModel: when `dn` does not belong to a teacher or
@@ -142,24 +138,41 @@ class AsmStaff(AsmModel, AnonymizeMixIn):
 		:raises ValueError: when non of the users `schools` is in the whitelist
 		"""
 		lo, po = get_ldap_connection()
-		try:
-			teacher = Teacher.from_dn(dn, None, lo)
-		except WrongModel:
-			teacher = TeachersAndStaff.from_dn(dn, None, lo)
-		if teacher.email and not check_domain(teacher.email):
+		snapshot = snapshot or DirectorySnapshot(lo)
+		return cls.from_object(snapshot.get_user(dn, 'staff'), ou_whitelist, snapshot)
+
+	@classmethod
+	def from_object(cls, teacher, ou_whitelist=None, snapshot=None, *args, **kwargs):
+		# type: (Union[SchoolUser, Teacher], Optional[Iterable[AnyStr]], Optional[DirectorySnapshot], *Any, **Any) -> AsmStaff
+		"""
+		Get AsmStaff object created from a loaded Teacher or TeachersAndStaff
+		object.
+
+		:param teacher: SchoolUser/Teacher/TeachersAndStaff object to represent
+		:param ou_whitelist: list of schools/OUs that should be considered when
+			looking at ou-overlapping users. No limit if empty or None.
+		:type ou_whitelist: list(str) or None
+		:param DirectorySnapshot snapshot: LDAP data of the current run (optional)
+		:return: AsmStaff instance
+		:rtype: AsmStaff
+		:raises ValueError: when non of the users `schools` is in the whitelist
+		"""
+		if not snapshot:
+			lo, po = get_ldap_connection()
+			snapshot = DirectorySnapshot(lo)
+		if teacher.email and not snapshot.check_mail_domain(teacher.email):
 			logger = logging.getLogger(__name__)
-			logger.warn('Invalid email domain in %r for DN %r.', teacher.email, dn)
-		email = prepend_to_mail_domain(teacher.email) if teacher.email else None
+			logger.warn('Invalid email domain in %r for DN %r.', teacher.email, teacher.dn)
+		plan = snapshot.plan
+		email = plan.prepend_to_mail_domain(teacher.email) if teacher.email else None
 		location_ids = [teacher.school] + sorted(s for s in teacher.schools if s != teacher.school)
 		if ou_whitelist:
 			location_ids = [l for l in location_ids if l in ou_whitelist]
 			if not location_ids:
 				raise ValueError('Non of the users schools is in the whitelist: {} (schools: {!r}).'.format(
 					teacher, teacher.schools))
-		additional_attrs = ['middleName', 'initials', 'oxMiddleName']
-		additional_attrs.extend({v[1:].strip() for v in cls.anonymize_mapping().values() if v and v.startswith('%')})
-		person_id_attr, teacher_lo = get_person_id(teacher.dn, 'staff', additional_attrs)
-		person_id = teacher_lo[person_id_attr][0]
+		person_id = snapshot.get_person_id(teacher.dn, 'staff')
+		teacher_lo = snapshot.get_attrs(teacher.dn)
 		middle_name = (
 				teacher_lo.get('middleName', [''])[0] or
 				teacher_lo.get('initials', [''])[0] or
@@ -168,6 +181,7 @@ class AsmStaff(AsmModel, AnonymizeMixIn):
 		return cls(**cls.anonymize(
 			teacher,
 			teacher_lo,
+			plan=plan,
 			person_id=person_id,
 			first_name=teacher.firstname,
 			last_name=teacher.lastname,
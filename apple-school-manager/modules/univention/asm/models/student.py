@@ -37,12 +37,14 @@ See https://support.apple.com/en-us/HT207029
 
 from __future__ import absolute_import, unicode_literals
 import logging
-from .base import AsmModel, AnonymizeMixIn
-from ..utils import check_domain, get_default_password_policy, get_person_id, get_ldap_connection, prepend_to_mail_domain
-from ucsschool.lib.models.user import Student
+from .base import AsmModel, AnonymizeMixIn, intern_string
+from ..snapshot import DirectorySnapshot
+from ..utils import get_default_password_policy, get_ldap_connection
 
 try:
-	from typing import Any, AnyStr, Iterable, Optional
+	from typing import Any, AnyStr, Iterable, Optional, Union
+	from ..snapshot import SchoolUser
+	from ucsschool.lib.models.user import Student
 except ImportError:
 	pass
 
@@ -54,7 +56,10 @@ class AsmStudent(AsmModel, AnonymizeMixIn):
 		'person_id', 'person_number', 'first_name', 'middle_name', 'last_name', 'grade_level',
 		'email_address', 'sis_username', 'password_policy', 'location_id'
 	)
+	__slots__ = header + ('additional_location_ids',)
 	ucr_anonymize_key_base = 'asm/attributes/student/anonymize'
+	variable_columns_attr = 'additional_location_ids'
+	variable_columns_name = 'location_id_{}'
 
 	def __init__(
 		self,
@@ -106,7 +111,7 @@ class AsmStudent(AsmModel, AnonymizeMixIn):
 		if additional_location_ids:
 			assert len(additional_location_ids) < 15, 'No more than 14 additional locations are allowed.'
 		else:
-			additional_location_ids = []
+			additional_location_ids = ()
 		super(AsmStudent, self).__init__(
 			person_id, first_name, last_name, location_id, person_number, middle_name, grade_level,
 			email_address, sis_username, additional_location_ids
@@ -114,27 +119,20 @@ class AsmStudent(AsmModel, AnonymizeMixIn):
 		self.person_id = person_id
 		self.first_name = first_name
 		self.last_name = last_name
-		self.location_id = location_id
+		self.location_id = intern_string(location_id)
 		self.person_number = person_number
 		self.middle_name = middle_name
-		self.grade_level = grade_level
+		self.grade_level = intern_string(grade_level)
 		self.email_address = email_address
 		self.sis_username = sis_username
-		self.password_policy = get_default_password_policy() if password_policy is None else password_policy
-		self.additional_location_ids = additional_location_ids
-		if additional_location_ids:
-			# add members, so that default as_csv_line() will work
-			location_id_attrs = ['location_id_{}'.format(num) for num in range(2, 2 + len(additional_location_ids))]
-			for loc_id_attr, loc_id in zip(location_id_attrs, additional_location_ids):
-				setattr(self, loc_id_attr, loc_id)
-			# update header
-			self.header = list(self.header) + [
-				'location_id_{}'.format(num) for num in range(2, 2 + len(additional_location_ids))
-			]
+		self.password_policy = intern_string(
+			get_default_password_policy() if password_policy is None else password_policy
+		)
+		self.additional_location_ids = tuple(intern_string(loc_id) for loc_id in additional_location_ids)
 
 	@classmethod
-	def from_dn(cls, dn, ou_whitelist=None, *args, **kwargs):
-		# type: (str, Optional[Iterable[AnyStr]], *Any, **Any) -> AsmStudent
+	def from_dn(cls, dn, ou_whitelist=None, snapshot=None, *args, **kwargs):
+		# type: (str, Optional[Iterable[AnyStr]], Optional[DirectorySnapshot], *Any, **Any) -> AsmStudent
 		"""
 		Get AsmStudent object created from data in LDAP object.
 
@@ -142,17 +140,39 @@ class AsmStudent(AsmModel, AnonymizeMixIn):
 		:param ou_whitelist: list of schools/OUs that should be considered when
 			looking at ou-overlapping users. No limit if empty or None.
 		:type ou_whitelist: list(str) or None
+		:param DirectorySnapshot snapshot: LDAP data of the current run (optional)
 		:return: AsmStudent instance
 		:rtype: AsmStudent
 		:raises WrongModel: when `dn` does not belong to a student
 		:raises ValueError: when non of the users `schools` is in the whitelist
 		"""
 		lo, po = get_ldap_connection()
-		student = Student.from_dn(dn, None, lo)
-		if student.email and not check_domain(student.email):
+		snapshot = snapshot or DirectorySnapshot(lo)
+		return cls.from_object(snapshot.get_user(dn, 'students'), ou_whitelist, snapshot)
+
+	@classmethod
+	def from_object(cls, student, ou_whitelist=None, snapshot=None, *args, **kwargs):
+		# type: (Union[SchoolUser, Student], Optional[Iterable[AnyStr]], Optional[DirectorySnapshot], *Any, **Any) -> AsmStudent
+		"""
+		Get AsmStudent object created from a loaded Student object.
+
+		:param student: SchoolUser/Student object to represent
+		:param ou_whitelist: list of schools/OUs that should be considered when
+			looking at ou-overlapping users. No limit if empty or None.
+		:type ou_whitelist: list(str) or None
+		:param DirectorySnapshot snapshot: LDAP data of the current run (optional)
+		:return: AsmStudent instance
+		:rtype: AsmStudent
+		:raises ValueError: when non of the users `schools` is in the whitelist
+		"""
+		if not snapshot:
+			lo, po = get_ldap_connection()
+			snapshot = DirectorySnapshot(lo)
+		if student.email and not snapshot.check_mail_domain(student.email):
 			logger = logging.getLogger(__name__)
-			logger.warn('Invalid email domain in %r for DN %r.', student.email, dn)
-		email = prepend_to_mail_domain(student.email) if student.email else None
+			logger.warn('Invalid email domain in %r for DN %r.', student.email, student.dn)
+		plan = snapshot.plan
+		email = plan.prepend_to_mail_domain(student.email) if student.email else None
 		location_ids = sorted(s for s in student.schools if s != student.school)
 		if student.school:
 			location_ids = [student.school] + location_ids
@@ -161,10 +181,8 @@ class AsmStudent(AsmModel, AnonymizeMixIn):
 			if not location_ids:
 				raise ValueError('Non of the users schools is in the whitelist: {} (schools: {!r}).'.format(
 					student, student.schools))
-		additional_attrs = ['middleName', 'initials', 'oxMiddleName']
-		additional_attrs.extend({v[1:].strip() for v in cls.anonymize_mapping().values() if v and v.startswith('%')})
-		person_id_attr, student_lo = get_person_id(student.dn, 'student', additional_attrs)
-		person_id = student_lo[person_id_attr][0]
+		person_id = snapshot.get_person_id(student.dn, 'students')
+		student_lo = snapshot.get_attrs(student.dn)
 		middle_name = (
 			student_lo.get('middleName', [''])[0] or
 			student_lo.get('initials', [''])[0] or
@@ -173,6 +191,7 @@ class AsmStudent(AsmModel, AnonymizeMixIn):
 		return cls(**cls.anonymize(
 			student,
 			student_lo,
+			plan=plan,
 			person_id=person_id,
 			first_name=student.firstname,
 			last_name=student.lastname,
@@ -182,6 +201,6 @@ class AsmStudent(AsmModel, AnonymizeMixIn):
 			grade_level=None,  # TODO: make conf. by UCR which LDAP attr to use
 			email_address=email,
 			sis_username=student.name,
-			password_policy=None,  # UCS password policy doesn't fit and nothing else is ...
+			password_policy=plan.password_policy,  # UCS password policy doesn't fit and nothing else is ...
 			additional_location_ids=location_ids[1:]  # ... stored in LDAP regarding password length
 		))
@@ -33,17 +33,43 @@ Univention Apple School Manager Connector
 sftp upload
 """
 
+import logging
 import os
+import time
 import paramiko
 
+from ..utils import get_sftp_settings
+
 
 class SFTP(object):
 
-	def __init__(self, hostname, username, password, host_key_line):
+	def __init__(
+			self, hostname, username, password, host_key_line, window_size=None, max_packet_size=None,
+			chunk_size=None, max_requests=None, port=22):
+		"""
+		Settings that are not passed are read from the UCR variables
+		`asm/sftp/*` (see :py:func:`get_sftp_settings()`).
+
+		:param int window_size: window size of the SSH channel
+		:param int max_packet_size: maximum packet size of the SSH channel
+		:param int chunk_size: bytes per SFTP write request
+		:param int max_requests: maximum number of unacknowledged write
+			requests, at most 100
+		:param int port: SSH port of the server
+		"""
+		settings = get_sftp_settings()
+		self.window_size = window_size or settings['window_size']
+		self.max_packet_size = max_packet_size or settings['max_packet_size']
+		self.chunk_size = chunk_size or settings['chunk_size']
+		# paramiko waits for *all* outstanding requests if there are more than 100
+		self.max_requests = min(max_requests or settings['max_requests'], 100)
+		self.logger = logging.getLogger(__name__)
 		self.client = paramiko.client.SSHClient()
 		self._set_host_key(host_key_line)
-		self.client.connect(hostname, username=username, password=password)
-		self.sftpClient = self.client.open_sftp()
+		self.client.connect(hostname, port=port, username=username, password=password)
+		self.sftpClient = paramiko.SFTPClient.from_transport(
+			self.client.get_transport(), window_size=self.window_size, max_packet_size=self.max_packet_size
+		)
 
 	def __enter__(self):
 		self.client.__enter__()
@@ -59,5 +85,99 @@ class SFTP(object):
 			host_keys.add(hostname, hostKeyEntry.key.get_name(), hostKeyEntry.key)
 
 	def upload(self, filename, remote_folder='/'):
+		"""
+		Upload a file as `archive.zip`.
+
+		The file is written in requests of :py:attr:`chunk_size` bytes,
+		without waiting for the server to acknowledge each request, but with
+		no more than :py:attr:`max_requests` unacknowledged requests. If the
+		installed paramiko version lacks the internals this relies on,
+		:py:meth:`paramiko.SFTPClient.putfo()` is used instead.
+
+		:param str filename: path of the file to upload
+		:param str remote_folder: directory on the server
+		:return: tuple (bytes uploaded, duration in seconds)
+		:rtype: tuple(int, float)
+		"""
 		remote_filename = os.path.join(remote_folder, 'archive.zip')
-		self.sftpClient.put(filename, remote_filename, confirm=False)
+		file_size = os.path.getsize(filename)
+		self.logger.debug(
+			'Uploading %d bytes (chunk size: %d, max. requests: %d, window size: %d, max. packet size: %d)...',
+			file_size, self.chunk_size, self.max_requests, self.window_size, self.max_packet_size
+		)
+		progress = _ProgressLogger(self.logger, file_size)
+		start = time.time()
+		with open(filename, 'rb') as fp:
+			if self._can_limit_requests():
+				self._upload_pipelined(fp, remote_filename, progress)
+			else:
+				self.logger.warning(
+					'Cannot limit the number of unacknowledged requests with paramiko %s, using putfo().',
+					paramiko.__version__
+				)
+				self.sftpClient.putfo(fp, remote_filename, file_size, callback=progress, confirm=False)
+		duration = time.time() - start
+		uploaded = progress.uploaded
+		self.logger.info(
+			'Uploaded %d bytes in %.1f seconds (%.1f KiB/s).',
+			uploaded, duration, uploaded / 1024.0 / duration if duration else 0.0
+		)
+		return uploaded, duration
+
+	def _can_limit_requests(self):
+		"""
+		Whether the paramiko internals used by :py:meth:`_upload_pipelined()`
+		exist.
+		"""
+		return (
+			hasattr(paramiko.SFTPFile, 'MAX_REQUEST_SIZE') and
+			callable(getattr(self.sftpClient, '_read_response', None))
+		)
+
+	def _upload_pipelined(self, fp, remote_filename, progress):
+		uploaded = 0
+		with self.sftpClient.open(remote_filename, 'wb', 0) as remote_fp:
+			remote_fp.set_pipelined(True)
+			remote_fp.MAX_REQUEST_SIZE = self.chunk_size
+			requests = getattr(remote_fp, '_reqs', None)
+			while True:
+				data = fp.read(self.chunk_size)
+				if not data:
+					break
+				remote_fp.write(data)
+				if requests is not None:
+					self._wait_for_requests(requests, self.max_requests)
+				uploaded += len(data)
+				progress(uploaded)
+
+	def _wait_for_requests(self, requests, max_requests):
+		"""
+		Read the responses to the oldest write requests in `requests` (the
+		queue of unacknowledged requests of a pipelined file), until at most
+		`max_requests` are unacknowledged. paramiko has no public API for
+		this.
+		"""
+		while len(requests) > max_requests:
+			t, msg = self.sftpClient._read_response(requests.popleft())
+			if t != paramiko.sftp.CMD_STATUS:
+				raise paramiko.SFTPError('Expected status')
+
+
+class _ProgressLogger(object):
+	"""
+	Callback for the number of bytes uploaded so far, logs the progress in
+	steps of 10%.
+	"""
+
+	def __init__(self, logger, file_size):
+		self.logger = logger
+		self.file_size = file_size
+		self.uploaded = 0
+		self._next_progress = file_size // 10
+
+	def __call__(self, uploaded, total=None):
+		self.uploaded = uploaded
+		if uploaded >= self._next_progress > 0:
+			self.logger.debug('Uploaded %d%% (%d bytes).', 100 * uploaded // self.file_size, uploaded)
+			while self._next_progress <= uploaded:
+				self._next_progress += self.file_size // 10
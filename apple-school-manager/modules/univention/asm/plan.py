@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018-2020 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Univention Apple School Manager Connector
+
+UCR settings that control how LDAP objects are transformed into ASM objects.
+"""
+
+from __future__ import absolute_import, unicode_literals
+from .utils import get_anonymize_mapping, get_default_password_policy, get_ucr, split_email
+
+try:
+	from typing import Any, AnyStr, Dict, List, Optional, Set, Tuple
+	from univention.config_registry import ConfigRegistry
+	from ucsschool.lib.models.user import User
+except ImportError:
+	pass
+
+
+class ExportPlan(object):
+	"""
+	All UCR variables that influence the content of the CSV files, read once
+	per run instead of once per row.
+
+	Create a new object to pick up UCR changes.
+	"""
+
+	anonymize_key_bases = ('asm/attributes/staff/anonymize', 'asm/attributes/student/anonymize')
+
+	def __init__(self, ucr=None):  # type: (Optional[ConfigRegistry]) -> None
+		"""
+		:param ConfigRegistry ucr: UCR object to read settings from, the
+			one of :py:func:`get_ucr()` if unset
+		"""
+		ucr = ucr or get_ucr()
+		self.email_subdomain = ucr.get('asm/attributes/user/email/prepend_domain', '').strip(' .')
+		self.course_name_pattern = ucr.get('asm/attributes/course-name-pattern', '{ou}-{name}')
+		self.class_number_empty = ucr.is_true('asm/attributes/classes/class_number_empty', True)
+		self.anonymize_substitutions = {}  # type: Dict[AnyStr, List[Tuple[AnyStr, Optional[AnyStr], Optional[AnyStr]]]]
+		self._anonymize_attrs = {}  # type: Dict[AnyStr, Set[AnyStr]]
+		for key_base in self.anonymize_key_bases:
+			substitutions = []
+			for field, value in sorted(get_anonymize_mapping(key_base).items()):
+				if value and value.startswith('%'):
+					substitutions.append((field, value[1:].strip(), None))
+				else:
+					substitutions.append((field, None, value))
+			self._anonymize_attrs[key_base] = {attr for field, attr, value in substitutions if attr}
+			if ucr.is_true(key_base):
+				self.anonymize_substitutions[key_base] = substitutions
+		self._password_policy = None  # type: AnyStr
+
+	@property
+	def password_policy(self):  # type: () -> AnyStr
+		"""
+		Password policy for students from `asm/attributes/student/password_policy`.
+
+		:raises ValueError: if the UCR variable has an invalid value
+		"""
+		if self._password_policy is None:
+			self._password_policy = get_default_password_policy()
+		return self._password_policy
+
+	def get_anonymize_attrs(self, ucr_key_base):  # type: (AnyStr) -> Set[AnyStr]
+		"""
+		Names of the LDAP attributes used as replacement values in
+		`<ucr_key_base>/<attribute>`.
+
+		:param str ucr_key_base: `asm/attributes/<staff/student>/anonymize`
+		:return: set of LDAP attribute names
+		:rtype: set(str)
+		"""
+		return self._anonymize_attrs[ucr_key_base.rstrip('/')]
+
+	def anonymize(self, ucr_key_base, user, ldap_attrs, kwargs):
+		# type: (AnyStr, User, Dict[AnyStr, Any], Dict[AnyStr, Any]) -> Dict[AnyStr, Any]
+		"""
+		Replace the values of the user attributes in `kwargs`, if
+		`ucr_key_base` is true.
+
+		:param str ucr_key_base: `asm/attributes/<staff/student>/anonymize`
+		:param User user: user object
+		:param dict ldap_attrs: dictionary with the users LDAP attributes
+		:param dict kwargs: arguments for the ASM model, will be modified
+		:return: `kwargs`
+		:rtype: dict
+		:raises ValueError: if an LDAP attribute used as replacement is not set
+		"""
+		for field, attr, value in self.anonymize_substitutions.get(ucr_key_base.rstrip('/'), []):
+			if attr:
+				try:
+					value = ldap_attrs[attr][0]
+				except KeyError:
+					raise ValueError('Attribute {!r} not found in LDAP object of {}.'.format(attr, user))
+				except IndexError:
+					raise ValueError('Attribute {!r} empty in LDAP object of {}.'.format(attr, user))
+			kwargs[field] = value
+		return kwargs
+
+	def prepend_to_mail_domain(self, email):  # type: (AnyStr) -> AnyStr
+		"""
+		Prepend subdomain from UCRV `asm/attributes/user/email/prepend_domain`
+		to domain in email address.
+
+		:param str email: email address
+		:return: if UCRV is set: modified email address, else unchanged email
+		:rtype: str
+		"""
+		if not email or not self.email_subdomain:
+			return email
+		local_part, domain = split_email(email)
+		return '{}@{}.{}'.format(local_part, self.email_subdomain, domain)
+
+	def get_course_name(self, school, name):  # type: (AnyStr, AnyStr) -> AnyStr
+		"""
+		Create a course name from `asm/attributes/course-name-pattern`.
+
+		:param str school: name of the school/OU
+		:param str name: name of the school class without OU prefix
+		:return: course name
+		:rtype: str
+		"""
+		return self.course_name_pattern.replace("{ou}", school).replace("{name}", name)
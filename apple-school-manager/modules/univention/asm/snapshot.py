@@ -0,0 +1,892 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018-2020 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Univention Apple School Manager Connector
+
+Run-scoped snapshot of the LDAP objects needed to create the ASM CSV files.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, namedtuple
+from functools import wraps
+from operator import attrgetter
+
+from ldap.filter import filter_format
+from ucsschool.lib.models.base import UnknownModel, WrongModel
+from ucsschool.lib.models.group import SchoolClass, WorkGroup
+from ucsschool.lib.models.school import School
+from ucsschool.lib.models.user import Student, Teacher, TeachersAndStaff
+from ucsschool.lib.roles import role_school_class, role_staff, role_student, role_teacher, role_workgroup
+from univention.admin import uexceptions
+from univention.uldap import parentDn
+
+from .plan import ExportPlan
+from .sorting import ExternalSorter
+from .utils import (
+	DNS_CHECK_TIMEOUT, DNS_CHECK_WORKERS, DNS_RECHECK_INTERVAL, check_domains, get_person_id_attr,
+	get_second_level_domain, get_ucr, get_user_filter, load_dns_cache, paged_search, save_dns_cache
+)
+
+try:
+	from typing import Any, AnyStr, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Type, Union
+	from ucsschool.importer.utils.ldap_connection import LoType
+	from ucsschool.lib.models.base import UCSSchoolHelperAbstractClass
+	from ucsschool.lib.models.user import User
+except ImportError:
+	pass
+
+
+def _synchronized(func):
+	"""Run method while holding the lock of the :py:class:`DirectorySnapshot`."""
+	@wraps(func)
+	def wrapper(self, *args, **kwargs):
+		with self._lock:
+			return func(self, *args, **kwargs)
+	return wrapper
+
+
+class SchoolGroup(namedtuple('SchoolGroup', ['dn', 'name', 'school', 'users', 'ucs_class'])):
+	"""
+	School class or work group loaded by :py:class:`DirectorySnapshot`. Has the
+	same attributes as :py:class:`SchoolClass` objects that are needed to create
+	ASM objects. `users` are the DNs in `uniqueMember`, `ucs_class` is either
+	:py:class:`SchoolClass` or :py:class:`WorkGroup`.
+	"""
+	__slots__ = ()
+
+
+class SchoolUser(namedtuple(
+		'SchoolUser', ['dn', 'name', 'school', 'schools', 'firstname', 'lastname', 'email', 'ucs_class'])):
+	"""
+	Student, teacher or staff user created directly from the raw LDAP attributes
+	loaded by :py:class:`DirectorySnapshot`, without going through UDM. Has the
+	same attributes as :py:class:`User` objects that are needed to create ASM
+	objects. `ucs_class` is either :py:class:`Student`, :py:class:`Teacher` or
+	:py:class:`TeachersAndStaff`.
+	"""
+	__slots__ = ()
+
+
+class DirectorySnapshot(object):
+	"""
+	In-memory view of schools, groups and users, shared by all CSV file
+	generators of one run.
+
+	The snapshot can be shared by generators running in parallel threads, each
+	thread can use its own LDAP connection (:py:meth:`use_connection()`).
+	The users of a role, the groups of a school etc. are loaded by one thread
+	only, with a lock per role or school (see :py:meth:`_load_once()`), so
+	threads wait only for the data they need themselves, while other threads
+	load other data.
+
+	Each type of object is loaded from LDAP only once, when it is first
+	needed, using paged searches (see :py:func:`paged_search()`). School
+	classes and work groups are loaded one school at a time. Afterwards they
+	are available through the indexes:
+
+	* school -> users: :py:meth:`get_school_users()`
+	* group -> members: :py:meth:`get_group_members()`
+	* user -> groups: :py:meth:`get_user_groups()`
+	* DN -> attributes: :py:meth:`get_attrs()`
+	* DN -> person_id: :py:meth:`get_person_ids()`
+
+	The attributes of a user are needed only until its ASM object has been
+	created, then they are dropped (:py:meth:`drop_attrs()`), only its
+	person_id is kept for the rosters and classes. The sorted users of a role
+	are kept in temporary files (see :py:meth:`get_users()`), but the DNs of
+	all users (:py:meth:`has_user()`, :py:meth:`get_school_users()`), their
+	person_ids and the members of all groups are kept in memory, so the
+	memory used still grows with the size of the directory.
+	"""
+
+	roles = ('staff', 'students')
+	ucr_roles = {'staff': 'staff', 'students': 'student'}
+	user_attrs = [
+		'uid', 'givenName', 'sn', 'mailPrimaryAddress', 'ucsschoolSchool', 'ucsschoolRole', 'objectClass',
+		'middleName', 'initials', 'oxMiddleName'
+	]
+	dn_chunk_size = 200
+	global_import_config_files = (
+		'/usr/share/ucs-school-import/configs/global_defaults.json',
+		'/var/lib/ucs-school-import/configs/global.json',
+		'/usr/share/ucs-school-import/configs/user_import_defaults.json',
+		'/var/lib/ucs-school-import/configs/user_import.json',
+		'/usr/share/ucs-school-import/configs/user_import_sisopi.json'
+	)
+	ou_import_config_dir = '/var/lib/ucs-school-import/configs'
+
+	def __init__(self, lo, ou_whitelist=None):  # type: (LoType, Optional[Iterable[AnyStr]]) -> None
+		"""
+		:param lo: LDAP connection object
+		:param ou_whitelist: list of schools/OUs that should be considered
+			when looking for LDAP objects. No limit if empty or None.
+		:type ou_whitelist: list(str) or None
+		"""
+		self._lo = lo
+		self._lock = threading.RLock()
+		self._load_locks = {}  # type: Dict[Tuple[AnyStr, Any], threading.Lock]
+		self._thread_local = threading.local()
+		self.ou_whitelist = ou_whitelist
+		self.logger = logging.getLogger(__name__)
+		self.ucr = get_ucr()
+		self.raw_users = self.ucr.is_true('asm/ldap/raw_users', False)
+		self._plan = None  # type: ExportPlan
+		self._all_schools = None  # type: List[School]
+		self._schools = None  # type: List[School]
+		self._exam_user_dns = None  # type: Set[AnyStr]
+		self._limbo_ou = None  # type: AnyStr
+		self._users = {}  # type: Dict[AnyStr, ExternalSorter]
+		self._school_users = {}  # type: Dict[AnyStr, Dict[AnyStr, Set[AnyStr]]]
+		self._max_location_ids = {}  # type: Dict[AnyStr, int]
+		self._user_dns = defaultdict(set)  # type: Dict[AnyStr, Set[AnyStr]]
+		self._school_person_ids = {}  # type: Dict[Tuple[AnyStr, AnyStr], Dict[AnyStr, AnyStr]]
+		self._attrs = {}  # type: Dict[AnyStr, Dict[AnyStr, List[Any]]]
+		self._person_ids = dict((role, {}) for role in self.roles)  # type: Dict[AnyStr, Dict[AnyStr, AnyStr]]
+		self._groups = {}  # type: Dict[AnyStr, List[SchoolGroup]]
+		self._groups_by_dn = {}  # type: Dict[AnyStr, SchoolGroup]
+		self._group_members = {}  # type: Dict[AnyStr, List[AnyStr]]
+		self._user_groups = defaultdict(list)  # type: Dict[AnyStr, List[AnyStr]]
+		self._mail_domains = {}  # type: Dict[AnyStr, Optional[bool]]
+		self._unverified_mail_domains = {}  # type: Dict[AnyStr, float]
+		self._pending_mail_domains = {}  # type: Dict[AnyStr, threading.Event]
+		self._dns_cache_loaded = False
+		self._local_mail_domains = None  # type: Set[AnyStr]
+
+	@property
+	def lo(self):  # type: () -> LoType
+		"""LDAP connection of the current thread (see :py:meth:`use_connection()`)."""
+		return getattr(self._thread_local, 'lo', self._lo)
+
+	def use_connection(self, lo):  # type: (LoType) -> None
+		"""
+		Use the LDAP connection `lo` for all LDAP operations started from the
+		current thread, so that generators running in parallel do not share a
+		connection.
+
+		:param lo: LDAP connection object
+		"""
+		self._thread_local.lo = lo
+
+	@_synchronized
+	def close(self):  # type: () -> None
+		"""
+		Delete the temporary files of sorted users (see
+		:py:meth:`get_users()`). Users are loaded again when needed.
+		"""
+		for users in self._users.values():
+			users.close()
+		self._users.clear()
+
+	@property
+	@_synchronized
+	def plan(self):  # type: () -> ExportPlan
+		"""UCR settings for transforming LDAP objects into ASM objects, read once per run."""
+		if self._plan is None:
+			self._plan = ExportPlan(self.ucr)
+		return self._plan
+
+	@property
+	@_synchronized
+	def all_schools(self):  # type: () -> List[School]
+		"""All School objects, sorted by name."""
+		if self._all_schools is None:
+			self._all_schools = sorted(School.get_all(self.lo), key=attrgetter('name'))
+		return self._all_schools
+
+	@property
+	@_synchronized
+	def schools(self):  # type: () -> List[School]
+		"""School objects, without the limbo OU, filtered by `self.ou_whitelist`, sorted by name."""
+		if self._schools is None:
+			schools = [s for s in self.all_schools if s.name != self.limbo_ou]
+			if self.ou_whitelist:
+				schools = [s for s in schools if s.name in self.ou_whitelist]
+			self._schools = schools
+		return self._schools
+
+	@property
+	@_synchronized
+	def limbo_ou(self):  # type: () -> AnyStr
+		"""
+		The "limbo_ou", in case we have a "Single source database, partial
+		import user import" scenario.
+
+		:return: name or limbo OU or empty string
+		:rtype: str
+		"""
+		# Not using the importer code to get the import configuration object,
+		# because that would trigger the configuration checks, and the import
+		# might not be configured properly.
+		if self._limbo_ou is None:
+			self._limbo_ou = ''
+			config_files = [cf for cf in self.global_import_config_files if os.path.exists(cf)]
+			# list the directory once, instead of checking for a file per OU
+			try:
+				existing_ou_configs = set(os.listdir(self.ou_import_config_dir))
+			except OSError:
+				existing_ou_configs = set()
+			config_files.extend(
+				os.path.join(self.ou_import_config_dir, '{}.json'.format(s.name)) for s in self.all_schools
+				if '{}.json'.format(s.name) in existing_ou_configs
+			)
+			config_files.reverse()  # search from most specific (OU) to most general (defaults)
+			for config_file in config_files:
+				with open(config_file, 'rb') as fp:
+					content = fp.read()
+				if b'"limbo_ou"' not in content:
+					continue  # don't parse (possibly large) configs without the key
+				config = json.loads(content)
+				if 'limbo_ou' in config:
+					self._limbo_ou = config['limbo_ou']
+					break
+		return self._limbo_ou
+
+	@property
+	@_synchronized
+	def local_mail_domains(self):  # type: () -> Set[AnyStr]
+		"""
+		Second level domains of the mail domains known to UCS (UDM `mail/domain`
+		objects, found with a single LDAP search) and of those in the UCR
+		variable `asm/dns/known_domains`. They are not checked with DNS.
+		"""
+		if self._local_mail_domains is None:
+			domains = {
+				attrs['cn'][0].decode('utf-8')
+				for dn, attrs in paged_search(self.lo, '(objectClass=univentionMailDomainname)', ['cn'])
+			}
+			domains.update(self.ucr.get('asm/dns/known_domains', '').replace(',', ' ').split())
+			self._local_mail_domains = {'.'.join(d.strip('.').split('.')[-2:]) for d in domains}
+			self.logger.debug('Known local mail domains: %s', ', '.join(sorted(self._local_mail_domains)))
+		return self._local_mail_domains
+
+	@property
+	@_synchronized
+	def exam_user_dns(self):  # type: () -> Set[AnyStr]
+		"""DNs of the exam users of :py:attr:`schools`, found with a single LDAP search."""
+		if self._exam_user_dns is None:
+			self._exam_user_dns = set()
+			if self.schools:
+				filter_s = '(&(|(objectClass=ucsschoolExam)(ucsschoolRole=exam_user:school:*)){})'.format(
+					self._get_schools_filter(s.name for s in self.schools)
+				)
+				self._exam_user_dns.update(dn for dn, attrs in paged_search(self.lo, filter_s, ['uid']))
+			self.logger.debug('Found %d exam users.', len(self._exam_user_dns))
+		return self._exam_user_dns
+
+	def get_school(self, dn):  # type: (AnyStr) -> School
+		"""
+		Get a School object.
+
+		:param str dn: DN of the school/OU
+		:return: School object
+		:rtype: School
+		:raises univention.admin.uexceptions.noObject: if no school with that DN exists
+		"""
+		for school in self._all_schools or []:
+			if school.dn.lower() == dn.lower():
+				return school
+		return School.from_dn(dn, None, self.lo)
+
+	def get_users(self, role):  # type: (AnyStr) -> ExternalSorter
+		"""
+		Find students or staff of all schools in a single LDAP search (per
+		distinct LDAP filter in `asm/ldap_filter/<role>[/<school>]`), instead of
+		searching in each school.
+
+		The school of a user is the first of its schools, that is in the
+		whitelist: the school of its position in LDAP, followed by its other
+		schools in alphabetical order.
+
+		If there are more users than fit into the memory budget of
+		:py:class:`ExternalSorter`, they are sorted in temporary files, that
+		are deleted by :py:meth:`close()`.
+
+		:param str role: `students` or `staff`
+		:return: iterable of (school, username, DN) tuples, sorted by 1. school, 2. username
+		:rtype: ExternalSorter
+		"""
+		assert role in self.roles
+		self._load_once(self._users, role, self._load_users)
+		return self._users[role]
+
+	def get_max_location_ids(self, role):  # type: (AnyStr) -> int
+		"""
+		Get the highest number of locations (schools in the whitelist) of the
+		students or staff found by :py:meth:`get_users()`.
+
+		:param str role: `students` or `staff`
+		:return: number of locations, 0 if there are no users
+		:rtype: int
+		"""
+		assert role in self.roles
+		self._load_once(self._users, role, self._load_users)
+		return self._max_location_ids[role]
+
+	def get_school_users(self, role, school):  # type: (AnyStr, AnyStr) -> Set[AnyStr]
+		"""
+		Get the DNs of the students or staff of a school, that match the LDAP
+		filter for that school.
+
+		:param str role: `students` or `staff`
+		:param str school: name of school/OU
+		:return: set of DNs
+		:rtype: set(str)
+		"""
+		assert role in self.roles
+		self._load_once(self._users, role, self._load_users)
+		return self._school_users[role].get(school, set())
+
+	def has_user(self, dn, role):  # type: (AnyStr, AnyStr) -> bool
+		"""
+		Whether a user was found by :py:meth:`get_users()`. Does not load any
+		users.
+
+		:param str dn: DN of user
+		:param str role: `students` or `staff`
+		:return: whether the user with DN `dn` and role `role` has been loaded
+		:rtype: bool
+		"""
+		return dn in self._user_dns[role]
+
+	def get_attrs(self, dn):  # type: (AnyStr) -> Dict[AnyStr, List[Any]]
+		"""
+		Get the LDAP attributes of a user that were loaded by
+		:py:meth:`get_users()` or :py:meth:`get_person_ids()`.
+
+		:param str dn: DN of user
+		:return: dictionary of LDAP attributes, empty if the user was not
+			loaded or its attributes have been dropped
+		:rtype: dict
+		"""
+		return self._attrs.get(dn, {})
+
+	def drop_attrs(self, dn):  # type: (AnyStr) -> None
+		"""
+		Drop the LDAP attributes of a user, after its ASM object has been
+		created. Its person_id is kept (see :py:meth:`get_person_ids()`).
+
+		:param str dn: DN of user
+		"""
+		self._attrs.pop(dn, None)
+
+	def get_person_id(self, dn, role):  # type: (AnyStr, AnyStr) -> AnyStr
+		"""
+		Get the person_id of a user.
+
+		:param str dn: DN of user
+		:param str role: `students` or `staff`
+		:return: value of the LDAP attribute configured in `asm/attributes/<role>/person_id/mapping`
+		:rtype: str
+		:raises ValueError: if the attribute is not set or empty
+		"""
+		return self.get_person_ids([dn], role)[dn]
+
+	def get_person_ids(self, dns, role):  # type: (Iterable[AnyStr], AnyStr) -> Dict[AnyStr, AnyStr]
+		"""
+		Get the person_ids of users.
+
+		The person_ids of users found by :py:meth:`get_users()` are already
+		known. The attributes of other users are loaded with a few searches of
+		:py:attr:`dn_chunk_size` users each, instead of one LDAP request per
+		user, only their person_ids are kept.
+
+		:param dns: DNs of users
+		:type dns: list(str)
+		:param str role: `students` or `staff`
+		:return: dict DN -> person_id
+		:rtype: dict(str, str)
+		:raises ValueError: if the attribute is not set or empty on a user
+		"""
+		dns = list(dns)
+		person_ids = self._person_ids[role]
+		self._load_attrs([dn for dn in dns if dn not in person_ids], role, keep_attrs=False)
+		res = {}
+		for dn in dns:
+			try:
+				res[dn] = person_ids[dn]
+			except KeyError:
+				person_id_attr, ucrv = get_person_id_attr(self.ucr_roles[role])
+				raise ValueError('Attribute {!r} from {!r} is not set or empty on {!r}.'.format(person_id_attr, ucrv, dn))
+		return res
+
+	def get_school_person_ids(self, role, school):  # type: (AnyStr, AnyStr) -> Dict[AnyStr, AnyStr]
+		"""
+		Get the person_ids of the students or staff of a school, that match
+		the LDAP filter for that school (see :py:meth:`get_school_users()`).
+
+		The mapping is created only once per school, so it can be used to
+		look up the members of all groups of the school.
+
+		:param str role: `students` or `staff`
+		:param str school: name of school/OU
+		:return: dict DN -> person_id
+		:rtype: dict(str, str)
+		:raises ValueError: if the person_id attribute is not set or empty on a user
+		"""
+		self._load_once(self._school_person_ids, (role, school), self._load_school_person_ids)
+		return self._school_person_ids[(role, school)]
+
+	def get_user_attr_names(self, role):  # type: (AnyStr) -> List[AnyStr]
+		"""
+		Names of LDAP attributes to load for users with role `role`: those
+		needed to create ASM objects from them, the person_id and those used
+		for anonymization.
+
+		:param str role: `students` or `staff`
+		:return: list of LDAP attribute names
+		:rtype: list(str)
+		"""
+		ucr_role = self.ucr_roles[role]
+		attrs = set(self.user_attrs)
+		attrs.add(get_person_id_attr(ucr_role)[0])
+		attrs.update(self.plan.get_anonymize_attrs('asm/attributes/{}/anonymize'.format(ucr_role)))
+		return sorted(attrs)
+
+	def check_mail_domains(self):  # type: () -> None
+		"""
+		Check the mail domains of all users loaded so far (see
+		:py:meth:`check_mail_domain()`).
+		"""
+		self._check_mail_domains([])
+
+	def check_mail_domain(self, email):  # type: (AnyStr) -> bool
+		"""
+		Verify that the second level domain of `email` exists.
+
+		Domains in :py:attr:`local_mail_domains` exist without asking DNS.
+		The first time another unchecked domain is requested, the domains of
+		all users loaded so far are checked concurrently (see
+		:py:func:`check_domains()`), so creating the ASM objects does not wait
+		for one DNS request after the other. The lock of the snapshot is not
+		held while waiting for DNS, so other threads can continue, unless they
+		need the result for one of the domains being checked.
+
+		Domains that could not be verified are checked again (together with
+		the other unverified domains) when requested after
+		`asm/dns/recheck_interval` seconds.
+
+		:param str email: an email address
+		:return: whether the domain exists, True if that could not be
+			determined within the time budget
+		:rtype: bool
+		:raises ValueError: if the email address has an invalid format
+		"""
+		domain = get_second_level_domain(email)
+		if self._needs_mail_domain_check(domain, time.time()):
+			self._check_mail_domains([domain])
+		return self._mail_domains[domain] is not False
+
+	def get_groups(self, school):  # type: (AnyStr) -> List[SchoolGroup]
+		"""
+		Get the school classes and work groups of a school. They are loaded
+		from LDAP when the school is first requested.
+
+		:param str school: name of school/OU
+		:return: list of SchoolGroup objects, sorted by name
+		:rtype: list(SchoolGroup)
+		"""
+		self._load_once(self._groups, school, self._load_groups)
+		return self._groups[school]
+
+	def get_group(self, dn):  # type: (AnyStr) -> Union[SchoolGroup, SchoolClass, WorkGroup]
+		"""
+		Get a school class or work group. If it was not loaded by
+		:py:meth:`get_groups()`, a SchoolClass or WorkGroup object is loaded.
+
+		:param str dn: DN of the group
+		:return: SchoolGroup, SchoolClass or WorkGroup object
+		:rtype: SchoolGroup or SchoolClass or WorkGroup
+		:raises WrongModel: if `dn` does not belong to a school class or work group
+		"""
+		try:
+			return self._groups_by_dn[dn]
+		except KeyError:
+			pass
+		school = SchoolClass.get_school_from_dn(dn)
+		ucs_class = self._get_group_class(school, dn) if school else None
+		if ucs_class:
+			return ucs_class.from_dn(dn, school, self.lo)
+		return self.get_object(dn, SchoolClass, WorkGroup)
+
+	def get_group_members(self, dn):  # type: (AnyStr) -> List[AnyStr]
+		"""
+		Get the DNs of the members of a school class or work group.
+
+		:param str dn: DN of the group
+		:return: list of DNs
+		:rtype: list(str)
+		"""
+		school = SchoolClass.get_school_from_dn(dn)
+		if school:
+			self.get_groups(school)
+		return self._group_members.get(dn, [])
+
+	def get_user_groups(self, dn):  # type: (AnyStr) -> List[AnyStr]
+		"""
+		Get the DNs of the school classes and work groups a user is member of.
+		Loads the groups of all schools.
+
+		:param str dn: DN of the user
+		:return: list of DNs
+		:rtype: list(str)
+		"""
+		for school in self.schools:
+			self.get_groups(school.name)
+		return self._user_groups.get(dn, [])
+
+	def get_memberships(self, role, school):  # type: (AnyStr, AnyStr) -> Iterator[Tuple[SchoolGroup, AnyStr, AnyStr]]
+		"""
+		Join the members of the school classes and work groups of a school
+		with its students or staff (see :py:meth:`get_school_users()`).
+
+		:param str role: `students` or `staff`
+		:param str school: name of school/OU
+		:return: iterator over tuples (group, user DN, person_id), sorted by
+			1. group name, 2. user DN
+		:rtype: Iterator
+		"""
+		person_ids = self.get_school_person_ids(role, school)
+		for group in self.get_groups(school):
+			# the members of one group are already in memory
+			for user_dn in sorted(group.users):
+				if user_dn in person_ids:
+					yield group, user_dn, person_ids[user_dn]
+
+	def get_user(self, dn, role):  # type: (AnyStr, AnyStr) -> Union[SchoolUser, User]
+		"""
+		Get a Student, Teacher or TeachersAndStaff object.
+
+		If the UCR variable `asm/ldap/raw_users` is true, a
+		:py:class:`SchoolUser` created from the already loaded LDAP attributes
+		is returned instead, skipping the UDM object altogether.
+
+		User objects are not kept in the snapshot, as every user object is
+		needed only once per run.
+
+		:param str dn: DN of the user
+		:param str role: `students` or `staff`
+		:return: SchoolUser, Student, Teacher or TeachersAndStaff object
+		:rtype: SchoolUser or User
+		:raises WrongModel: if `dn` does not belong to a user with the `role`
+		"""
+		assert role in self.roles
+		if dn not in self._attrs:
+			self._load_attrs([dn], role)
+		ucs_class = self.get_ucs_class(self.get_attrs(dn))
+		if role == 'students':
+			ucs_classes = (Student,)
+		else:
+			ucs_classes = (Teacher, TeachersAndStaff)
+		if ucs_class in ucs_classes:
+			if self.raw_users:
+				return self.get_school_user(dn, ucs_class)
+			return ucs_class.from_dn(dn, None, self.lo)
+		return self.get_object(dn, *ucs_classes)
+
+	def get_school_user(self, dn, ucs_class):  # type: (AnyStr, Type[User]) -> SchoolUser
+		"""
+		Create a :py:class:`SchoolUser` from the loaded LDAP attributes of a
+		user. The attributes are mapped like the UDM users/user module and
+		ucsschool lib do it.
+
+		:param str dn: DN of the user
+		:param ucs_class: Student, Teacher or TeachersAndStaff
+		:return: SchoolUser object
+		:rtype: SchoolUser
+		"""
+		attrs = self.get_attrs(dn)
+
+		def _value(attr):  # type: (AnyStr) -> AnyStr
+			return attrs.get(attr, [b''])[0].decode('utf-8')
+
+		school = ucs_class.get_school_from_dn(dn)
+		schools = [s.decode('utf-8') for s in attrs.get('ucsschoolSchool', [])] or [school]
+		return SchoolUser(
+			dn=dn,
+			name=_value('uid'),
+			school=school,
+			schools=schools,
+			firstname=_value('givenName'),
+			lastname=_value('sn'),
+			email=_value('mailPrimaryAddress') or None,
+			ucs_class=ucs_class,
+		)
+
+	@staticmethod
+	def get_ucs_class(attrs):  # type: (Dict[AnyStr, List[Any]]) -> Optional[Type[UCSSchoolHelperAbstractClass]]
+		"""
+		Find the ucsschool lib class for an LDAP object from its `ucsschoolRole`
+		and `objectClass` attributes, instead of trying to load it with each
+		possible class.
+
+		:param dict attrs: LDAP attributes of the object
+		:return: SchoolClass, WorkGroup, Student, Teacher, TeachersAndStaff or
+			None if the object is none of them
+		"""
+		roles = {role.split(':', 1)[0] for role in attrs.get('ucsschoolRole', [])}
+		object_classes = set(attrs.get('objectClass', []))
+		if role_school_class in roles:
+			return SchoolClass
+		elif role_workgroup in roles:
+			return WorkGroup
+		elif 'ucsschoolExam' in object_classes:
+			return None
+		elif role_student in roles or 'ucsschoolStudent' in object_classes:
+			return Student
+		elif {role_teacher, role_staff} <= roles or {'ucsschoolTeacher', 'ucsschoolStaff'} <= object_classes:
+			return TeachersAndStaff
+		elif role_teacher in roles or 'ucsschoolTeacher' in object_classes:
+			return Teacher
+		return None
+
+	def get_object(self, dn, *ucs_classes):
+		# type: (AnyStr, *Type[UCSSchoolHelperAbstractClass]) -> UCSSchoolHelperAbstractClass
+		"""
+		Load the object with DN `dn` using the first of `ucs_classes` that
+		matches. Used for objects without (valid) `ucsschoolRole` and
+		`objectClass` attributes.
+
+		:param str dn: DN of the object
+		:param ucs_classes: ucsschool lib classes to try
+		:return: ucsschool lib object
+		:raises WrongModel: if non of the `ucs_classes` matches
+		"""
+		for ucs_class in ucs_classes[:-1]:
+			try:
+				return ucs_class.from_dn(dn, None, self.lo)
+			except (UnknownModel, WrongModel):
+				pass
+		return ucs_classes[-1].from_dn(dn, None, self.lo)
+
+	def _load_once(self, cache, key, load):  # type: (Dict[Any, Any], Any, Callable[[Any], None]) -> None
+		"""
+		Call `load(key)` unless `key` is in `cache` already. `load` must add
+		`key` to `cache` after everything else it loads. Threads that need
+		the same key wait for the thread loading it, threads loading other
+		keys don't.
+		"""
+		if key in cache:
+			return
+		with self._lock:
+			load_lock = self._load_locks.setdefault((load.__name__, key), threading.Lock())
+		with load_lock:
+			if key not in cache:
+				load(key)
+
+	def _load_users(self, role):  # type: (AnyStr) -> None
+		if role == 'students':
+			type_filter = '(objectClass=ucsschoolStudent)'
+			excluded_dns = self.exam_user_dns
+		else:
+			type_filter = '(|{}{})'.format(Teacher.type_filter, TeachersAndStaff.type_filter)
+			excluded_dns = set()
+		excluded = set()  # type: Set[AnyStr]
+		global_ldap_filter_str = self.ucr.get("asm/ldap_filter/{}".format(role), "")
+		schools_by_filter = defaultdict(set)
+		for school in self.schools:
+			specific_ldap_filter = self.ucr.get(
+				"asm/ldap_filter/{}/{}".format(role, school.name), global_ldap_filter_str
+			)
+			schools_by_filter[specific_ldap_filter].add(school.name)
+
+		users = ExternalSorter()
+		school_users = defaultdict(set)
+		max_location_ids = 0
+		for specific_ldap_filter, schools in schools_by_filter.items():
+			try:
+				filter_s = get_user_filter(type_filter, self._get_schools_filter(schools), specific_ldap_filter)
+			except uexceptions.valueInvalidSyntax:
+				self.logger.error("Invalid LDAP-filter for {}: {!r}".format(role, specific_ldap_filter))
+				raise
+			for dn, attrs in paged_search(self.lo, filter_s, self.get_user_attr_names(role)):
+				user_schools = [s.decode('utf-8') for s in attrs.get('ucsschoolSchool', [])]
+				found_in_schools = schools.intersection(user_schools)
+				if not found_in_schools:
+					continue
+				if dn in excluded_dns:
+					excluded.add(dn)  # may be found with the LDAP filters of several schools
+					continue
+				for school in found_in_schools:
+					school_users[school].add(dn)
+				if dn in self._user_dns[role]:
+					continue  # already found with the LDAP filter of another school
+				self._user_dns[role].add(dn)
+				self._store_attrs(dn, attrs, role)
+				school = Student.get_school_from_dn(dn)
+				location_ids = sorted(s for s in user_schools if s != school)
+				if school:
+					location_ids = [school] + location_ids
+				if self.ou_whitelist:
+					location_ids = [s for s in location_ids if s in self.ou_whitelist]
+				users.add((location_ids[0], attrs['uid'][0].decode('utf-8'), dn))
+				max_location_ids = max(max_location_ids, len(location_ids))
+		if excluded:
+			self.logger.info('Excluded %d exam users from %s.', len(excluded), role)
+		self.logger.debug(
+			'Found %d %s with %d LDAP searches.', len(users), role, len(schools_by_filter)
+		)
+		self._school_users[role] = dict(school_users)
+		self._max_location_ids[role] = max_location_ids
+		self._users[role] = users  # sorted by 1. school, 2. username, set last (see _load_once())
+
+	@staticmethod
+	def _get_schools_filter(schools):  # type: (Iterable[AnyStr]) -> AnyStr
+		return '(|{})'.format(''.join(filter_format('(ucsschoolSchool=%s)', (school,)) for school in sorted(schools)))
+
+	def _load_school_person_ids(self, key):  # type: (Tuple[AnyStr, AnyStr]) -> None
+		role, school = key
+		self._school_person_ids[key] = self.get_person_ids(self.get_school_users(role, school), role)
+
+	def _load_attrs(self, dns, role, keep_attrs=True):  # type: (List[AnyStr], AnyStr, Optional[bool]) -> None
+		attr_names = self.get_user_attr_names(role)
+		for i in range(0, len(dns), self.dn_chunk_size):
+			filter_s = '(|{})'.format(
+				''.join(filter_format('(entryDN=%s)', (dn,)) for dn in dns[i:i + self.dn_chunk_size])
+			)
+			for dn, attrs in paged_search(self.lo, filter_s, attr_names):
+				self._store_attrs(dn, attrs, role, keep_attrs)
+
+	def _check_mail_domains(self, domains):  # type: (Iterable[AnyStr]) -> None
+		with self._lock:
+			domains = set(domains)
+			for attrs in self._attrs.values():
+				for email in attrs.get('mailPrimaryAddress', []):
+					try:
+						domains.add(get_second_level_domain(email.decode('utf-8')))
+					except ValueError:
+						pass  # will be raised when the user object is created
+			now = time.time()
+			domains = set(domain for domain in domains if self._needs_mail_domain_check(domain, now))
+			local_domains = domains.intersection(self.local_mail_domains)
+			for domain in local_domains:
+				self._mail_domains[domain] = True
+			domains.difference_update(local_domains)
+			# domains being checked by another thread
+			other_checks = set(self._pending_mail_domains[d] for d in domains if d in self._pending_mail_domains)
+			domains.difference_update(self._pending_mail_domains)
+			if domains:
+				done = threading.Event()
+				for domain in domains:
+					self._pending_mail_domains[domain] = done
+				try:
+					workers = int(self.ucr.get('asm/dns/check_workers', DNS_CHECK_WORKERS))
+					timeout = float(self.ucr.get('asm/dns/check_timeout', DNS_CHECK_TIMEOUT))
+				except ValueError:
+					workers, timeout = DNS_CHECK_WORKERS, DNS_CHECK_TIMEOUT
+				if not self._dns_cache_loaded:
+					load_dns_cache()
+					self._dns_cache_loaded = True
+		for other_check in other_checks:
+			other_check.wait()
+		if not domains:
+			return
+		# DNS requests are made without holding the lock
+		t0 = time.time()
+		results = {}  # type: Dict[AnyStr, bool]
+		try:
+			results = check_domains(domains, workers, timeout)
+			save_dns_cache()
+		finally:
+			with self._lock:
+				for domain in domains:
+					self._mail_domains[domain] = results.get(domain)
+					if domain in results:
+						self._unverified_mail_domains.pop(domain, None)
+					else:
+						self._unverified_mail_domains[domain] = time.time()
+					del self._pending_mail_domains[domain]
+			done.set()
+		self.logger.debug('Checked %d mail domains in %.1f seconds.', len(domains), time.time() - t0)
+		if len(results) < len(domains):
+			self.logger.warning(
+				'Could not verify %d of %d mail domains within %d seconds: %s',
+				len(domains) - len(results), len(domains), timeout, ', '.join(sorted(set(domains) - set(results)))
+			)
+
+	def _needs_mail_domain_check(self, domain, now):  # type: (AnyStr, float) -> bool
+		if domain not in self._mail_domains:
+			return True
+		checked = self._unverified_mail_domains.get(domain)
+		if checked is None:
+			return False
+		try:
+			interval = float(self.ucr.get('asm/dns/recheck_interval', DNS_RECHECK_INTERVAL))
+		except ValueError:
+			interval = DNS_RECHECK_INTERVAL
+		return now - checked >= interval
+
+	def _store_attrs(self, dn, attrs, role, keep_attrs=True):
+		# type: (AnyStr, Dict[AnyStr, List[Any]], AnyStr, Optional[bool]) -> None
+		person_id = attrs.get(get_person_id_attr(self.ucr_roles[role])[0])
+		if person_id and person_id[0]:
+			self._person_ids[role][dn] = person_id[0]
+		if keep_attrs:
+			# users have many object classes, only the UCS@school ones are needed by get_ucs_class()
+			attrs['objectClass'] = [oc for oc in attrs.get('objectClass', []) if oc.startswith(b'ucsschool')]
+			self._attrs[dn] = attrs
+
+	@staticmethod
+	def _get_group_class(school, dn):  # type: (AnyStr, AnyStr) -> Optional[Type[SchoolClass]]
+		parent_dn = parentDn(dn).lower()
+		for ucs_class in (SchoolClass, WorkGroup):
+			if parent_dn == ucs_class.get_container(school).lower():
+				return ucs_class
+		return None
+
+	def _load_groups(self, school):  # type: (AnyStr) -> None
+		groups = []
+		school_dn = School.cache(school).dn
+		try:
+			for dn, attrs in paged_search(self.lo, '(objectClass=univentionGroup)', ['cn', 'uniqueMember'], base=school_dn):
+				ucs_class = self._get_group_class(school, dn)
+				if ucs_class:
+					groups.append(SchoolGroup(
+						dn=dn,
+						name=attrs['cn'][0].decode('utf-8'),
+						school=school,
+						users=attrs.get('uniqueMember', []),
+						ucs_class=ucs_class,
+					))
+		except uexceptions.noObject:
+			self.logger.warning('School %r does not exist.', school)
+		groups.sort(key=attrgetter('name'))
+		for group in groups:
+			self._groups_by_dn[group.dn] = group
+			self._group_members[group.dn] = group.users
+			for user_dn in group.users:
+				self._user_groups[user_dn].append(group.dn)
+		self._groups[school] = groups  # set last (see _load_once())
+		self.logger.debug('Found %d school classes and work groups in school %r.', len(groups), school)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018-2020 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Univention Apple School Manager Connector
+
+Sorting with a memory budget.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import cPickle as pickle
+import heapq
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+from .utils import get_sort_memory_budget
+
+try:
+	from typing import Any, Iterable, Iterator, List, Optional
+except ImportError:
+	pass
+
+
+def _estimate_size(item):  # type: (Any) -> int
+	if isinstance(item, tuple):
+		return sys.getsizeof(item) + sum(sys.getsizeof(value) for value in item)
+	return sys.getsizeof(item)
+
+
+class ExternalSorter(object):
+	"""
+	Collects items and iterates over them in sorted order.
+
+	If the estimated size of the collected items exceeds the memory budget,
+	they are sorted and written to a temporary file (a "run"). When iterating,
+	the runs and the remaining items are merged, reading one batch of each
+	run at a time. Without runs, this is the same as :py:func:`sorted()`.
+
+	To limit the number of files open at the same time, no more than
+	:py:attr:`max_runs` runs are merged at once. If there are more, they are
+	first merged in groups into fewer, larger runs.
+
+	The object can be iterated multiple times. The temporary files are
+	deleted by :py:meth:`close()`, also when used as a context manager::
+
+		with ExternalSorter() as users:
+			users.extend(items)
+			for item in users:
+				...
+	"""
+
+	batch_size = 1000  # items per pickle in a run
+	max_runs = 64  # runs merged at once
+
+	def __init__(self, memory_budget=None, tmp_dir=None):  # type: (Optional[int], Optional[str]) -> None
+		"""
+		:param int memory_budget: bytes the collected items may use before
+			they are written to a temporary file, 0 for no limit, the value of
+			UCR variable `asm/sort/memory_budget` if unset
+		:param str tmp_dir: directory to create the temporary files in,
+			default of :py:mod:`tempfile` if unset
+		"""
+		self._runs = []  # type: List[str]
+		self._run_dir = None  # type: Optional[str]
+		self._run_dir_pid = None  # type: Optional[int]
+		self._run_count = 0
+		self._merge_lock = threading.Lock()
+		self._items = []  # type: List[Any]
+		self._items_size = 0
+		self._items_sorted = True
+		self._len = 0
+		self.memory_budget = get_sort_memory_budget() if memory_budget is None else memory_budget
+		self.tmp_dir = tmp_dir
+		self.logger = logging.getLogger(__name__)
+
+	def __enter__(self):  # type: () -> ExternalSorter
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):  # type: (Any, Any, Any) -> None
+		self.close()
+
+	def __del__(self):  # type: () -> None
+		self.close()
+
+	def __len__(self):  # type: () -> int
+		return self._len
+
+	def __iter__(self):  # type: () -> Iterator[Any]
+		if not self._items_sorted:
+			self._items.sort()
+			self._items_sorted = True
+		if not self._runs:
+			return iter(self._items)
+		with self._merge_lock:
+			while len(self._runs) + 1 > self.max_runs:  # +1 for the items in memory
+				self._merge_runs()
+			runs = list(self._runs)
+		return heapq.merge(self._items, *[self._read_run(path) for path in runs])
+
+	def add(self, item):  # type: (Any) -> None
+		"""
+		Add an item.
+
+		:param item: item to add
+		"""
+		self._items.append(item)
+		self._items_sorted = False
+		self._len += 1
+		if self.memory_budget:
+			self._items_size += _estimate_size(item)
+			if self._items_size > self.memory_budget:
+				self._write_run()
+
+	def extend(self, items):  # type: (Iterable[Any]) -> None
+		"""
+		Add items.
+
+		:param items: items to add
+		"""
+		for item in items:
+			self.add(item)
+
+	def close(self):  # type: () -> None
+		"""
+		Delete the temporary files. Items written to them are lost.
+		"""
+		if self._run_dir:
+			if self._run_dir_pid == os.getpid():  # not in a forked worker process
+				shutil.rmtree(self._run_dir, ignore_errors=True)
+				self.logger.debug('Deleted %d sorted runs in %s.', len(self._runs), self._run_dir)
+			self._run_dir = None
+			self._runs = []
+
+	def _write_run(self):  # type: () -> None
+		self._items.sort()
+		path = self._dump_run(self._items)
+		self.logger.debug('Wrote sorted run of %d items to %s.', len(self._items), path)
+		self._runs.append(path)
+		self._items = []
+		self._items_size = 0
+		self._items_sorted = True
+
+	def _merge_runs(self):  # type: () -> None
+		runs = self._runs
+		self._runs = []
+		for i in range(0, len(runs), self.max_runs):
+			group = runs[i:i + self.max_runs]
+			if len(group) > 1:
+				path = self._dump_run(heapq.merge(*[self._read_run(run) for run in group]))
+				for run in group:
+					os.remove(run)
+				group = [path]
+			self._runs.extend(group)
+		self.logger.debug('Merged %d sorted runs into %d.', len(runs), len(self._runs))
+
+	def _dump_run(self, items):  # type: (Iterable[Any]) -> str
+		if not self._run_dir:
+			self._run_dir = tempfile.mkdtemp(prefix='asm-sort-', dir=self.tmp_dir)
+			self._run_dir_pid = os.getpid()
+		path = os.path.join(self._run_dir, 'run{}'.format(self._run_count))
+		self._run_count += 1
+		with open(path, 'wb') as fp:
+			batch = []
+			for item in items:
+				batch.append(item)
+				if len(batch) == self.batch_size:
+					pickle.dump(batch, fp, pickle.HIGHEST_PROTOCOL)
+					batch = []
+			if batch:
+				pickle.dump(batch, fp, pickle.HIGHEST_PROTOCOL)
+		return path
+
+	@staticmethod
+	def _read_run(path):  # type: (str) -> Iterator[Any]
+		with open(path, 'rb') as fp:
+			while True:
+				try:
+					batch = pickle.load(fp)
+				except EOFError:
+					return
+				for item in batch:
+					yield item
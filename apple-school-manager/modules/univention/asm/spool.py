@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2018-2020 Univention GmbH
+#
+# http://www.univention.de/
+#
+# All rights reserved.
+#
+# The source code of this program is made available
+# under the terms of the GNU Affero General Public License version 3
+# (GNU AGPL V3) as published by the Free Software Foundation.
+#
+# Binary versions of this program provided by Univention to you as
+# well as other copyrighted, protected or trademarked materials like
+# Logos, graphics, fonts, specific documentations and configurations,
+# cryptographic keys etc. are subject to a license agreement between
+# you and Univention and not subject to the GNU AGPL V3.
+#
+# In the case you use this program under the terms of the GNU AGPL V3,
+# the program is provided in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License with the Debian GNU/Linux or Univention distribution in file
+# /usr/share/common-licenses/AGPL-3; if not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Univention Apple School Manager Connector
+
+Spool directory of ZIP files waiting to be uploaded.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import glob
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+
+try:
+	from typing import Any, AnyStr, Dict, List, Optional, Tuple
+except ImportError:
+	pass
+
+SPOOL_PATH = '/var/lib/asm/spool'
+
+
+class UploadSpool(object):
+	"""
+	Directory of finished ZIP files that have not been uploaded yet.
+
+	Each ZIP file `asm_<timestamp>.zip` has a metadata file
+	`asm_<timestamp>.json` with the time it was created, the hash of its
+	content (see :py:attr:`AsmZipFile.content_hash`), the number of failed
+	upload attempts and the last error. A ZIP file without metadata file is
+	incomplete and ignored.
+
+	Only the newest ZIP file is of interest, as every ZIP file contains all
+	data. Adding a ZIP file removes the older ones.
+	"""
+
+	def __init__(self, path=SPOOL_PATH):  # type: (AnyStr) -> None
+		"""
+		:param str path: spool directory, created if it does not exist
+		"""
+		self.path = path
+		self.logger = logging.getLogger(__name__)
+		if not os.path.isdir(path):
+			os.makedirs(path, 0o700)
+
+	def new_zip_path(self):  # type: () -> AnyStr
+		"""
+		Get the path for a new ZIP file in the spool directory.
+
+		:return: path of the ZIP file
+		:rtype: str
+		"""
+		return os.path.join(self.path, 'asm_{}.zip'.format(datetime.isoformat(datetime.now())))
+
+	def add(self, zip_path, content_hash):  # type: (AnyStr, AnyStr) -> Dict[AnyStr, Any]
+		"""
+		Add a finished ZIP file (created at :py:meth:`new_zip_path()`) and
+		remove all other ZIP files, including incomplete ones left behind by
+		aborted runs.
+
+		:param str zip_path: path of the ZIP file in the spool directory
+		:param str content_hash: hash of the content of the ZIP file
+		:return: metadata
+		:rtype: dict
+		"""
+		metadata = {
+			'created': time.time(),
+			'content_hash': content_hash,
+			'size': os.path.getsize(zip_path),
+			'attempts': 0,
+			'last_error': None,
+		}
+		self.update(zip_path, metadata)
+		for old_zip_path in glob.glob(os.path.join(self.path, 'asm_*.zip')):
+			if old_zip_path != zip_path:
+				self.logger.info('Removing outdated ZIP file %s from spool.', old_zip_path)
+				self.remove(old_zip_path)
+		return metadata
+
+	def update(self, zip_path, metadata):  # type: (AnyStr, Dict[AnyStr, Any]) -> None
+		"""
+		Write the metadata of a ZIP file. The file is replaced atomically.
+
+		:param str zip_path: path of the ZIP file in the spool directory
+		:param dict metadata: metadata
+		"""
+		fd, tmp_path = tempfile.mkstemp(prefix='.metadata.', dir=self.path)
+		try:
+			with os.fdopen(fd, 'wb') as fp:
+				json.dump(metadata, fp)
+				fp.flush()
+				os.fsync(fp.fileno())
+			os.rename(tmp_path, self._metadata_path(zip_path))
+		except (IOError, OSError):
+			os.remove(tmp_path)
+			raise
+
+	def get_all(self):  # type: () -> List[Tuple[AnyStr, Dict[AnyStr, Any]]]
+		"""
+		Get the complete ZIP files in the spool directory, newest first.
+
+		:return: list of tuples (path of ZIP file, metadata)
+		:rtype: list(tuple(str, dict))
+		"""
+		res = []
+		for zip_path in glob.glob(os.path.join(self.path, 'asm_*.zip')):
+			try:
+				with open(self._metadata_path(zip_path), 'rb') as fp:
+					metadata = json.load(fp)
+			except (IOError, OSError, ValueError):
+				continue
+			res.append((zip_path, metadata))
+		res.sort(key=lambda x: x[1].get('created', 0), reverse=True)
+		return res
+
+	def get_newest(self):  # type: () -> Optional[Tuple[AnyStr, Dict[AnyStr, Any]]]
+		"""
+		Get the newest complete ZIP file in the spool directory.
+
+		:return: tuple (path of ZIP file, metadata) or None if the spool is empty
+		:rtype: tuple(str, dict) or None
+		"""
+		spooled = self.get_all()
+		return spooled[0] if spooled else None
+
+	def remove(self, zip_path):  # type: (AnyStr) -> None
+		"""
+		Remove a ZIP file and its metadata from the spool directory.
+
+		:param str zip_path: path of the ZIP file in the spool directory
+		"""
+		for path in (self._metadata_path(zip_path), zip_path):
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+
+	@staticmethod
+	def _metadata_path(zip_path):  # type: (AnyStr) -> AnyStr
+		return '{}.json'.format(os.path.splitext(zip_path)[0])
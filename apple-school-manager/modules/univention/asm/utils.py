@@ -34,18 +34,49 @@ Utility functions.
 """
 
 # don't import __future__.unicode_literals here, DNS lib cannot handle it!
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from Queue import Empty, Queue
 import DNS
+from ldap.controls import SimplePagedResultsControl
+import univention.admin.handlers.users.user as udm_user_module
+from univention.admin.filter import conjunction, parse
+from univention.admin.uldap import access, position
 from univention.config_registry import ConfigRegistry
 from ucsschool.importer.utils.ldap_connection import get_machine_connection, get_readonly_connection
 
 try:
-	from typing import Dict, List, Text, Tuple
+	from typing import Any, Dict, Iterable, Iterator, List, Optional, Text, Tuple
 	from ucsschool.importer.utils.ldap_connection import LoType, PoType
 except ImportError:
 	pass
 
+LDAP_PAGE_SIZE = 1000
+SORT_MEMORY_BUDGET = 256  # MiB
+SFTP_SETTINGS = {
+	'window_size': 2 * 1024 * 1024,  # paramiko default
+	'max_packet_size': 32 * 1024,  # paramiko default
+	'chunk_size': 32 * 1024,  # bytes per write request, the size all SFTP servers must support
+	'max_requests': 64,  # unacknowledged write requests, like OpenSSH sftp
+}
+UPLOAD_RETRY_SETTINGS = (600.0, 5.0, 120.0)  # time budget, initial delay, maximum delay (seconds)
+UPLOAD_SPOOL_MAX_AGE = 3600.0  # age in seconds up to which a ZIP file of a failed upload is uploaded instead of a new one
+DNS_TIMEOUT = 5  # timeout of a single DNS request
+DNS_CHECK_WORKERS = 10
+DNS_CHECK_TIMEOUT = 30  # time budget for checking all domains of a run
+DNS_RECHECK_INTERVAL = 300  # time after which domains that could not be verified are checked again
 _external_dns_resolvers = []  # type: List[str]
+DNS_CACHE_PATH = '/var/lib/asm/dns_cache.json'
+DNS_CACHE_TTL_POSITIVE = 86400
+DNS_CACHE_TTL_NEGATIVE = 3600
 _known_domains = {}  # type: Dict[str, bool]
+_known_domains_timestamps = {}  # type: Dict[str, float]
+_dns_cache_stats = {'hits': 0, 'misses': 0}  # type: Dict[str, int]
+_dns_threads = []  # type: List[threading.Thread]
 _ucr = None  # type: ConfigRegistry
 
 
@@ -56,6 +87,226 @@ def get_ldap_connection():  # type: () -> (Tuple[LoType, PoType])
 		return get_machine_connection()
 
 
+def get_new_ldap_connection():  # type: () -> (Tuple[LoType, PoType])
+	"""
+	Open a new LDAP connection, that is not shared with other callers (unlike
+	:py:func:`get_ldap_connection()`), e.g. for a worker thread. It connects
+	to the same server with the same (on a DC master or DC backup read-only)
+	credentials as :py:func:`get_ldap_connection()`. The caller should
+	`unbind()` it when it is not needed anymore.
+
+	:return: tuple (LDAP connection, position)
+	:rtype: tuple
+	"""
+	lo, po = get_ldap_connection()
+	new_lo = access(host=lo.host, port=lo.port, base=lo.base, binddn=lo.binddn, bindpw=lo.bindpw)
+	return new_lo, position(po.getBase())
+
+
+def get_csv_workers():  # type: () -> int
+	"""
+	Get the number of CSV files to create in parallel from UCR variable
+	`asm/csv/workers`.
+
+	Users are loaded as UDM objects unless `asm/ldap/raw_users` is
+	activated, and that is not done from several threads. So without
+	`asm/ldap/raw_users` this is always 1.
+
+	:return: number of worker threads, 1 if unset or invalid
+	:rtype: int
+	"""
+	ucr = get_ucr()
+	try:
+		workers = int(ucr.get('asm/csv/workers', 1))
+	except ValueError:
+		workers = 1
+	if workers > 1 and not ucr.is_true('asm/ldap/raw_users', False):
+		logging.getLogger(__name__).warning(
+			'Not creating CSV files in parallel threads, because asm/ldap/raw_users is not activated.')
+		return 1
+	return max(1, workers)
+
+
+def get_csv_processes():  # type: () -> Tuple[int, int]
+	"""
+	Get the number of processes to create staff and student objects in and
+	the number of users per process pool task from UCR variables
+	`asm/csv/processes` and `asm/csv/shard_size`.
+
+	:return: tuple (number of processes, users per task), (1, 5000) if unset
+		or invalid
+	:rtype: tuple(int, int)
+	"""
+	ucr = get_ucr()
+	try:
+		processes = int(ucr.get('asm/csv/processes', 1))
+		shard_size = int(ucr.get('asm/csv/shard_size', 5000))
+	except ValueError:
+		processes, shard_size = 1, 5000
+	return max(1, processes), max(1, shard_size)
+
+
+def get_zip_compression():  # type: () -> Tuple[int, int]
+	"""
+	Get the zlib compression level for the ZIP file entries and the number of
+	threads to compress them in from UCR variables `asm/zip/compression_level`
+	and `asm/zip/compression_threads`.
+
+	:return: tuple (compression level, threads), (6, 1) if unset or invalid
+	:rtype: tuple(int, int)
+	"""
+	ucr = get_ucr()
+	try:
+		level = int(ucr.get('asm/zip/compression_level', 6))
+		threads = int(ucr.get('asm/zip/compression_threads', 1))
+	except ValueError:
+		level, threads = 6, 1
+	if not 0 <= level <= 9:
+		level = 6
+	return level, max(1, threads)
+
+
+def get_sort_memory_budget():  # type: () -> int
+	"""
+	Get the amount of memory that sorting users may use, before sorted runs
+	are written to temporary files, from UCR variable `asm/sort/memory_budget`
+	(in MiB).
+
+	:return: memory budget in bytes, 0 for no limit,
+		:py:data:`SORT_MEMORY_BUDGET` MiB if unset or invalid
+	:rtype: int
+	"""
+	try:
+		budget = int(get_ucr().get('asm/sort/memory_budget', SORT_MEMORY_BUDGET))
+	except ValueError:
+		budget = SORT_MEMORY_BUDGET
+	return max(0, budget) * 1024 * 1024
+
+
+def get_upload_retry_settings():  # type: () -> Tuple[float, float, float]
+	"""
+	Get the settings for retrying failed uploads from UCR variables
+	`asm/upload/retry/time_budget`, `asm/upload/retry/delay` and
+	`asm/upload/retry/max_delay` (all in seconds).
+
+	:return: tuple (time budget, initial delay, maximum delay), the values of
+		:py:data:`UPLOAD_RETRY_SETTINGS` if unset or invalid
+	:rtype: tuple(float, float, float)
+	"""
+	ucr = get_ucr()
+	try:
+		time_budget = float(ucr.get('asm/upload/retry/time_budget', UPLOAD_RETRY_SETTINGS[0]))
+		delay = float(ucr.get('asm/upload/retry/delay', UPLOAD_RETRY_SETTINGS[1]))
+		max_delay = float(ucr.get('asm/upload/retry/max_delay', UPLOAD_RETRY_SETTINGS[2]))
+	except ValueError:
+		return UPLOAD_RETRY_SETTINGS
+	return max(0.0, time_budget), max(0.0, delay), max(delay, max_delay)
+
+
+def get_upload_spool_max_age():  # type: () -> float
+	"""
+	Get the age up to which a ZIP file left in the spool directory by a failed
+	upload is uploaded instead of creating a new one, from UCR variable
+	`asm/upload/spool/max_age` (in seconds).
+
+	:return: maximum age in seconds, :py:data:`UPLOAD_SPOOL_MAX_AGE` if unset
+		or invalid
+	:rtype: float
+	"""
+	try:
+		return max(0.0, float(get_ucr().get('asm/upload/spool/max_age', UPLOAD_SPOOL_MAX_AGE)))
+	except ValueError:
+		return UPLOAD_SPOOL_MAX_AGE
+
+
+def get_sftp_settings():  # type: () -> Dict[str, int]
+	"""
+	Get the settings for the SFTP upload from UCR variables
+	`asm/sftp/window_size`, `asm/sftp/max_packet_size`, `asm/sftp/chunk_size`
+	and `asm/sftp/max_requests`.
+
+	:return: dict with keys `window_size`, `max_packet_size`, `chunk_size`
+		and `max_requests`, the values of :py:data:`SFTP_SETTINGS` for unset
+		or invalid variables
+	:rtype: dict(str, int)
+	"""
+	ucr = get_ucr()
+	settings = {}
+	for key, default in SFTP_SETTINGS.items():
+		try:
+			settings[key] = int(ucr.get('asm/sftp/{}'.format(key), default))
+		except ValueError:
+			settings[key] = default
+		if settings[key] < 1:
+			settings[key] = default
+	return settings
+
+
+def get_ldap_page_size():  # type: () -> int
+	"""
+	Get the number of results per page for paged LDAP searches from UCR
+	variable `asm/ldap/page_size`.
+
+	:return: page size, :py:data:`LDAP_PAGE_SIZE` if unset or invalid
+	:rtype: int
+	"""
+	try:
+		page_size = int(get_ucr().get('asm/ldap/page_size', LDAP_PAGE_SIZE))
+	except ValueError:
+		page_size = LDAP_PAGE_SIZE
+	return page_size if page_size > 0 else LDAP_PAGE_SIZE
+
+
+def paged_search(lo, filter_s, attr=None, base=None, page_size=None):
+	# type: (LoType, Text, Optional[List[Text]], Optional[Text], Optional[int]) -> Iterator[Tuple[Text, Dict[Text, List[Any]]]]
+	"""
+	Search LDAP using the simple paged results control (RFC 2696).
+
+	Results are yielded page by page, so only one page of results is held in
+	memory by this function.
+
+	:param lo: LDAP connection object
+	:param str filter_s: LDAP filter
+	:param attr: attributes to retrieve, all if empty or None
+	:type attr: list(str) or None
+	:param str base: search base, LDAP base if unset
+	:param int page_size: number of results per page, value of
+		:py:func:`get_ldap_page_size()` if unset
+	:return: iterator over tuples (DN, attributes dict)
+	:rtype: Iterator
+	"""
+	base = base or get_ucr()['ldap/base']
+	attr = map(str, attr or [])  # unicode2str for python-ldap
+	page_control = SimplePagedResultsControl(True, size=page_size or get_ldap_page_size(), cookie='')
+	while True:
+		response = {}
+		for dn, attrs in lo.search(
+				str(filter_s), base=base, attr=attr, serverctrls=[page_control], response=response):
+			yield dn, attrs
+		cookies = [
+			ctrl.cookie for ctrl in response.get('ctrls', [])
+			if ctrl.controlType == SimplePagedResultsControl.controlType
+		]
+		if not cookies or not cookies[0]:
+			break
+		page_control.cookie = cookies[0]
+
+
+def get_user_filter(*filter_strs):  # type: (*Text) -> Text
+	"""
+	Create an LDAP filter for user objects from all non-empty ``filter_strs``.
+
+	UDM property names are mapped to LDAP attributes, the same way UDM does it
+	when searching for ``users/user`` objects.
+
+	:return: LDAP filter
+	:rtype: str
+	:raises univention.admin.uexceptions.valueInvalidSyntax: if a filter cannot be parsed
+	"""
+	filter_p = conjunction('&', [parse(filter_s) for filter_s in filter_strs if filter_s])
+	return str(udm_user_module.lookup_filter(str(filter_p)))
+
+
 def check_domain(email):  # type: (str) -> bool
 	"""
 	Verify that the second level domain in ``email`` exists.
@@ -65,16 +316,206 @@ def check_domain(email):  # type: (str) -> bool
 	:rtype: bool
 	:raises ValueError: if the email address has an invalid format
 	"""
-	local_part, domain = split_email(email)
-	domain_to_check = '.'.join(domain.split('.')[-2:])
-	if domain_to_check not in _known_domains:
-		dns_servers = get_static_dns_resolvers()
-		requester = DNS.DnsRequest(server=dns_servers, timeout=5)
-		dns_result = requester.req(name=str(domain_to_check), qtype='A')  # type: DNS.Lib.DnsResult
-		_known_domains[domain_to_check] = bool(dns_result.answers)
+	domain_to_check = get_second_level_domain(email)
+	if domain_to_check in _known_domains:
+		_dns_cache_stats['hits'] += 1
+	else:
+		_dns_cache_stats['misses'] += 1
+		_known_domains[domain_to_check] = _query_domain(domain_to_check)
+		_known_domains_timestamps[domain_to_check] = time.time()
 	return _known_domains[domain_to_check]
 
 
+def check_domains(domains, workers=DNS_CHECK_WORKERS, timeout=DNS_CHECK_TIMEOUT):
+	# type: (Iterable[str], int, float) -> Dict[str, bool]
+	"""
+	Verify that the second level domains ``domains`` exist, sending up to
+	``workers`` DNS requests concurrently. Domains that were not answered
+	within ``timeout`` seconds or whose request failed are missing from the
+	result, they are not cached.
+
+	After ``timeout`` seconds the threads sending the requests don't start
+	new requests, but the running requests are not aborted. Use
+	:py:func:`join_dns_threads()` to wait for them.
+
+	:param domains: second level domains (see :py:func:`get_second_level_domain()`)
+	:type domains: list(str)
+	:param int workers: maximum number of concurrent DNS requests
+	:param float timeout: time budget in seconds for all requests
+	:return: dict domain -> whether it exists
+	:rtype: dict(str, bool)
+	"""
+	domains = set(domains)
+	unknown_domains = sorted(domains - set(_known_domains))
+	_dns_cache_stats['hits'] += len(domains) - len(unknown_domains)
+	_dns_cache_stats['misses'] += len(unknown_domains)
+	if unknown_domains:
+		get_static_dns_resolvers()  # fill list before threads access it
+		deadline = time.time() + timeout
+		todo = Queue()
+		for domain in unknown_domains:
+			todo.put(domain)
+		results = Queue()
+
+		def query_domains():  # type: () -> None
+			while time.time() < deadline:
+				try:
+					domain = todo.get_nowait()
+				except Empty:
+					return
+				results.put(_query_domain_no_raise(domain))
+
+		for _ in range(max(1, min(workers, len(unknown_domains)))):
+			thread = threading.Thread(target=query_domains, name='DNS check')
+			thread.daemon = True
+			thread.start()
+			_dns_threads.append(thread)
+		for _ in unknown_domains:
+			remaining = deadline - time.time()
+			if remaining <= 0:
+				break
+			try:
+				domain, exists = results.get(timeout=remaining)
+			except Empty:
+				break
+			if exists is not None:
+				_known_domains[domain] = exists
+				_known_domains_timestamps[domain] = time.time()
+	return dict((domain, _known_domains[domain]) for domain in domains if domain in _known_domains)
+
+
+def join_dns_threads():  # type: () -> None
+	"""
+	Wait for the DNS requests started by :py:func:`check_domains()` that
+	were still running when it returned. Must be called before forking, so
+	no thread holds a lock that stays locked in the child process.
+
+	:return: None
+	"""
+	while _dns_threads:
+		_dns_threads.pop().join()
+
+
+def load_dns_cache(path=DNS_CACHE_PATH):  # type: (str) -> int
+	"""
+	Add the domains stored by :py:func:`save_dns_cache()` to the known
+	domains of :py:func:`check_domain()`, skipping expired entries. The TTLs
+	are read from UCR variables `asm/dns/cache/ttl_positive` and
+	`asm/dns/cache/ttl_negative`.
+
+	:param str path: path of the cache file
+	:return: number of domains loaded
+	:rtype: int
+	"""
+	logger = logging.getLogger(__name__)
+	ucr = get_ucr()
+	try:
+		ttls = {
+			True: int(ucr.get('asm/dns/cache/ttl_positive', DNS_CACHE_TTL_POSITIVE)),
+			False: int(ucr.get('asm/dns/cache/ttl_negative', DNS_CACHE_TTL_NEGATIVE)),
+		}
+	except ValueError:
+		ttls = {True: DNS_CACHE_TTL_POSITIVE, False: DNS_CACHE_TTL_NEGATIVE}
+	entries = _read_dns_cache(path)
+	now = time.time()
+	num = 0
+	for domain, entry in entries.items():
+		try:
+			exists, timestamp = entry
+			timestamp = float(timestamp)
+		except (TypeError, ValueError):
+			continue  # malformed entry, will be dropped by the next save_dns_cache()
+		if not isinstance(exists, bool):
+			continue  # malformed entry, unverified domains are never saved
+		domain = str(domain)
+		if domain not in _known_domains and now - timestamp < ttls[exists]:
+			_known_domains[domain] = exists
+			_known_domains_timestamps[domain] = timestamp
+			num += 1
+	logger.debug('Loaded %d of %d domains from DNS cache %r.', num, len(entries), path)
+	return num
+
+
+def save_dns_cache(path=DNS_CACHE_PATH):  # type: (str) -> None
+	"""
+	Store the results of :py:func:`check_domain()` and
+	:py:func:`check_domains()` with their timestamps in ``path``.
+
+	Entries written by concurrent runs in the meantime are merged, the newer
+	entry wins. The file is replaced atomically, so readers see either the
+	old or the new content.
+
+	:param str path: path of the cache file
+	:return: None
+	"""
+	logger = logging.getLogger(__name__)
+	entries = dict(
+		(domain, entry) for domain, entry in _read_dns_cache(path).items()
+		if isinstance(entry, list) and len(entry) == 2 and isinstance(entry[0], bool)
+		and isinstance(entry[1], (int, float))
+	)
+	for domain, timestamp in _known_domains_timestamps.items():
+		if domain not in entries or entries[domain][1] < timestamp:
+			entries[domain] = [_known_domains[domain], timestamp]
+	try:
+		fd, tmp_path = tempfile.mkstemp(prefix='.dns_cache.', dir=os.path.dirname(path))
+		try:
+			with os.fdopen(fd, 'wb') as fp:
+				json.dump(entries, fp)
+				fp.flush()
+				os.fsync(fp.fileno())
+			os.rename(tmp_path, path)
+		except (IOError, OSError):
+			os.remove(tmp_path)
+			raise
+	except (IOError, OSError) as exc:
+		logger.warning('Could not write DNS cache %r: %s', path, exc)
+		return
+	hits, misses = _dns_cache_stats['hits'], _dns_cache_stats['misses']
+	logger.info(
+		'DNS cache: %d hits, %d misses (hit rate %.0f%%).', hits, misses, 100.0 * hits / (hits + misses or 1))
+
+
+def _read_dns_cache(path):  # type: (str) -> Dict[str, List[Any]]
+	try:
+		with open(path, 'rb') as fp:
+			entries = json.load(fp)
+		if not isinstance(entries, dict):
+			raise ValueError('Expected a JSON object, found {}.'.format(type(entries).__name__))
+		return entries
+	except (IOError, OSError, ValueError) as exc:
+		if os.path.exists(path):
+			logging.getLogger(__name__).warning('Could not read DNS cache %r: %s', path, exc)
+		return {}
+
+
+def get_second_level_domain(email):  # type: (str) -> str
+	"""
+	Get the second level domain of an email address.
+
+	:param str email: an email address
+	:return: second level domain (e.g. `example.com` for `a@mail.example.com`)
+	:rtype: str
+	:raises ValueError: if the email address has an invalid format
+	"""
+	local_part, domain = split_email(email)
+	return '.'.join(domain.split('.')[-2:])
+
+
+def _query_domain(domain):  # type: (str) -> bool
+	dns_servers = get_static_dns_resolvers()
+	requester = DNS.DnsRequest(server=dns_servers, timeout=DNS_TIMEOUT)
+	dns_result = requester.req(name=str(domain), qtype='A')  # type: DNS.Lib.DnsResult
+	return bool(dns_result.answers)
+
+
+def _query_domain_no_raise(domain):  # type: (str) -> Tuple[str, Optional[bool]]
+	try:
+		return domain, _query_domain(domain)
+	except (DNS.DNSError, IOError):
+		return domain, None
+
+
 def get_static_dns_resolvers():  # type: () -> List[str]
 	"""
 	Get external DNS resolvers from UCR
@@ -134,12 +575,24 @@ def split_email(email):  # type: (str) -> Tuple[str, str]
 	return local_part, domain
 
 
-def get_person_id(dn, role, additional_attrs):  # type: (Text, Text, List[Text]) -> Tuple[Text, Dict[Text, Text]]
+def get_person_id_attr(role):  # type: (Text) -> Tuple[Text, Text]
+	"""
+	Get the name of the LDAP attribute that holds the person_id of users with
+	role `role`.
+
+	:param str role: `staff` or `student`
+	:return: tuple (LDAP attribute name, name of UCRV it was read from)
+	:rtype: tuple(str, str)
+	"""
 	assert role in ('staff', 'student')
-	additional_attrs = additional_attrs or []
 	ucrv = 'asm/attributes/{}/person_id/mapping'.format(role)
 	person_id_attr = get_ucr().get(ucrv, '%entryUUID')
-	person_id_attr = person_id_attr[1:].strip()
+	return person_id_attr[1:].strip(), ucrv
+
+
+def get_person_id(dn, role, additional_attrs):  # type: (Text, Text, List[Text]) -> Tuple[Text, Dict[Text, Text]]
+	additional_attrs = additional_attrs or []
+	person_id_attr, ucrv = get_person_id_attr(role)
 	attrs = map(str, [person_id_attr] + additional_attrs)  # unicode2str for python-ldap
 	lo, po = get_ldap_connection()
 	res = lo.get(dn, attrs)
@@ -148,6 +601,26 @@ def get_person_id(dn, role, additional_attrs):  # type: (Text, Text, List[Text])
 	return person_id_attr, res
 
 
+def get_anonymize_mapping(ucr_key_base):  # type: (Text) -> Dict[Text, Optional[Text]]
+	"""
+	Get the replacement values for anonymized user attributes.
+
+	:param str ucr_key_base: `asm/attributes/<staff/student>/anonymize`
+	:return: dict attribute name -> replacement value, replacement values
+		starting with `%` name an LDAP attribute
+	:rtype: dict
+	"""
+	ucr_key_base = ucr_key_base.rstrip('/')
+	ucr = get_ucr()
+	return {
+		'first_name': ucr.get('{}/first_name'.format(ucr_key_base), '%uid'),
+		'middle_name': ucr.get('{}/middle_name'.format(ucr_key_base), None),
+		'last_name': ucr.get('{}/last_name'.format(ucr_key_base), 'No Name'),
+		'email_address': ucr.get('{}/email_address'.format(ucr_key_base), None),
+		'sis_username': ucr.get('{}/sis_username'.format(ucr_key_base), '%uid'),
+	}
+
+
 def get_default_password_policy():
 	ucr = get_ucr()
 	pp_ori = ucr.get('asm/attributes/student/password_policy', 4)